@@ -1,23 +1,98 @@
-import json
 import os
-import http.client
 from datetime import datetime
+from functools import partial
 
-from flask import Flask, jsonify, abort, request, redirect, url_for, session
+import httpx
+from sqlalchemy.orm.exc import StaleDataError
+
+from flask import Flask, Response, jsonify, abort, request, redirect, url_for, session
 
 from auth import AuthError, requires_auth
-from models import setup_db, db, Actor, Movie
+from http_client import CircuitOpenError, identity_client
+from models import setup_db, db, Actor, Movie, CatalogStats, ACTOR_FIELDS, MOVIE_FIELDS
+from pagination import get_fields, get_int_arg, get_date_arg, get_sort, slice_page
+from export import ndjson_response
+from search import SEARCH_COLUMNS, include_object, search_page, text_changed
+from graph import MAX_PATH_DEPTH, get_graph
+from serializers import entities_response, entity_response, entity_dicts, entity_etag
+from read_models import export_query, fetch_records, paginate_records
+from bulk import (BatchError, validate_actor, validate_movie, validate_batch, validate_ids,
+                  require_existing, bulk_insert, bulk_update, bulk_delete, existing_ids,
+                  linked_actor_ids, add_links, remove_links, adjust_stats, claim_version)
+from cache import response_cache
+from changes import changes_page
+from idempotency import idempotent
+from metrics import REGISTRY, CONTENT_TYPE
+import changes
+import idempotency
+import instrumentation
+import replicas
+import search
+import serializers
 from flask_cors import CORS
 from flask_migrate import Migrate
 
+ACTOR_SORTS = {'movie_count': Actor.movie_count}
+MOVIE_SORTS = {'actor_count': Movie.actor_count}
+WRITE_ATTEMPTS = 5
+
+
+def actor_filters(args):
+    filters = []
+    age_min = get_int_arg('age_min', args)
+    if age_min is not None:
+        filters.append(Actor.age >= age_min)
+    age_max = get_int_arg('age_max', args)
+    if age_max is not None:
+        filters.append(Actor.age <= age_max)
+    gender = args.get('gender')
+    if gender:
+        filters.append(Actor.gender == gender)
+    movie_count_min = get_int_arg('movie_count_min', args)
+    if movie_count_min is not None:
+        filters.append(Actor.movie_count >= movie_count_min)
+    movie_count_max = get_int_arg('movie_count_max', args)
+    if movie_count_max is not None:
+        filters.append(Actor.movie_count <= movie_count_max)
+    return filters
+
+
+def movie_filters(args):
+    filters = []
+    release_date_min = get_date_arg('release_date_min', args)
+    if release_date_min is not None:
+        filters.append(Movie.release_date >= release_date_min)
+    release_date_max = get_date_arg('release_date_max', args)
+    if release_date_max is not None:
+        filters.append(Movie.release_date <= release_date_max)
+    title_prefix = args.get('title_prefix')
+    if title_prefix:
+        filters.append(Movie.title.startswith(title_prefix, autoescape=True))
+    actor_count_min = get_int_arg('actor_count_min', args)
+    if actor_count_min is not None:
+        filters.append(Movie.actor_count >= actor_count_min)
+    actor_count_max = get_int_arg('actor_count_max', args)
+    if actor_count_max is not None:
+        filters.append(Movie.actor_count <= actor_count_max)
+    return filters
+
 
 def create_app(test_config=None):
     app = Flask(__name__)
-    setup_db(app)
+    setup_db(app, schema_mode='create' if test_config == 'testing' else None)
+    replicas.init_app(app)
     CORS(app)
 
     # Initialize Flask-Migrate with app and db
-    migrate = Migrate(app, db)
+    migrate = Migrate(app, db, include_object=include_object)
+    response_cache.init_app(app)
+    idempotency.init_app(app)
+    changes.init_app(app)
+    search.init_app(app)
+    app.config['JSON_DATE_FORMAT'] = os.getenv('JSON_DATE_FORMAT', 'http')
+    app.config['JSON_ENCODER'] = os.getenv('JSON_ENCODER', 'auto')
+    serializers.init_app(app)
+    instrumentation.init_app(app)
 
     AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
     API_IDENTIFIER = os.getenv('API_IDENTIFIER')
@@ -27,8 +102,83 @@ def create_app(test_config=None):
         REDIRECT_URI = 'https://casting-agency-3r88.onrender.com/callback'
     else:
         REDIRECT_URI = 'http://127.0.0.1:5000/callback'
+    app.config.update(AUTH0_DOMAIN=AUTH0_DOMAIN, API_IDENTIFIER=API_IDENTIFIER,
+                      CLIENT_ID=CLIENT_ID, CLIENT_SECRET=CLIENT_SECRET,
+                      REDIRECT_URI=REDIRECT_URI,
+                      AUTH0_TOKEN_URL=os.getenv('AUTH0_TOKEN_URL',
+                                                f'https://{AUTH0_DOMAIN}/oauth/token'))
 
     app.secret_key = 'fsda'
+    app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', '100'))
+    app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+    app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+    app.config['BATCH_MAX_SIZE'] = int(os.getenv('BATCH_MAX_SIZE', '500'))
+
+    def get_batch_body(key):
+        body = request.get_json()
+        if not body:
+            abort(400)
+        return body.get(key)
+
+    def get_actor_ids():
+        body = request.get_json()
+        if not body:
+            abort(400)
+        actor_ids = body.get('actor_ids', [])
+        if not isinstance(actor_ids, list) or not all(
+                isinstance(actor_id, int) and not isinstance(actor_id, bool)
+                for actor_id in actor_ids):
+            abort(400)
+        return actor_ids
+
+    def actors_changed(actor_ids=()):
+        response_cache.invalidate('actors', *(f'actor:{actor_id}' for actor_id in actor_ids))
+
+    def movies_changed(movie_ids=()):
+        response_cache.invalidate('movies', *(f'movie:{movie_id}' for movie_id in movie_ids))
+
+    def check_if_match(model, row, claim=False):
+        """Abort with 412 unless ``row`` matches the request's ``If-Match``.
+
+        With ``claim`` the matching version is claimed as well, so that a
+        write committed since ``row`` was read fails the request.
+        """
+        if 'If-Match' not in request.headers:
+            return
+        if not request.if_match.contains(entity_etag(row)) or (
+                claim and not claim_version(model, row.id, row.version)):
+            abort(412)
+
+    def save_row(model, row, values):
+        """Set ``values`` on ``row`` and commit, returning the written row.
+
+        A write that loses a race with another fails with 412 under
+        ``If-Match``. Without it the last writer wins: the row is reloaded
+        and the write retried, up to ``WRITE_ATTEMPTS`` times.
+        """
+        row_id = row.id
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                for name, value in values.items():
+                    setattr(row, name, value)
+                if SEARCH_COLUMNS[model].key in values:
+                    text_changed(model)
+                db.session.commit()
+                return row
+            except StaleDataError:
+                db.session.rollback()
+                if 'If-Match' in request.headers:
+                    abort(412)
+            except:
+                db.session.rollback()
+                abort(422)
+            row = model.query.get(row_id)
+            if row is None:
+                abort(404)
+        abort(409)
+
+    def batch_response(model, ids, key):
+        return entities_response(model, key, fetch_records(model, ids))
 
     @app.route('/login')
     def login():
@@ -45,18 +195,21 @@ def create_app(test_config=None):
         if not code:
             return jsonify({'error': 'Authorization code not found'}), 400
 
-        conn = http.client.HTTPSConnection(AUTH0_DOMAIN)
-        payload = f'client_id={CLIENT_ID}&client_secret={CLIENT_SECRET}&code={code}&grant_type=authorization_code&redirect_uri={REDIRECT_URI}'
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        conn.request("POST", "/oauth/token", payload, headers)
-        res = conn.getresponse()
-        data = res.read()
+        try:
+            res = identity_client.post(app.config['AUTH0_TOKEN_URL'], data={
+                'client_id': CLIENT_ID,
+                'client_secret': CLIENT_SECRET,
+                'code': code,
+                'grant_type': 'authorization_code',
+                'redirect_uri': REDIRECT_URI
+            })
+        except (httpx.HTTPError, CircuitOpenError):
+            return jsonify({'error': 'Identity provider unavailable'}), 503
 
-        if res.status != 200:
+        if res.status_code != 200:
             return jsonify({'error': 'Failed to obtain access token'}), 400
 
-        token_info = json.loads(data)
+        token_info = res.json()
 
         session['access_token'] = token_info.get('access_token')
 
@@ -77,33 +230,112 @@ def create_app(test_config=None):
     def get_greeting():
         return 'Welcome!'
 
+    @app.route('/metrics')
+    def get_metrics():
+        token = os.getenv('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
     @app.route('/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @response_cache.cached('get:actors', lambda: ['actors'])
     def get_actors():
-        result = Actor.query.all()
+        fields = get_fields(ACTOR_FIELDS)
+        result, next_cursor = paginate_records(Actor, actor_filters(request.args), fields,
+                                               *get_sort(ACTOR_SORTS))
         if not result:
             abort(404)
-        actors = []
-        for actor in result:
-            actors.append(actor.get_actor())
+        return entities_response(Actor, "actors", result, fields, next_cursor=next_cursor)
+
+    @app.route('/search/actors', methods=['GET'])
+    @requires_auth('get:actors')
+    @response_cache.cached('get:actors', lambda: ['actors'])
+    def search_actors():
+        fields = get_fields(ACTOR_FIELDS)
+        result, next_cursor = search_page(Actor)
+        return entities_response(Actor, "actors", result, fields, next_cursor=next_cursor)
+
+    @app.route('/search/movies', methods=['GET'])
+    @requires_auth('get:movies')
+    @response_cache.cached('get:movies', lambda: ['movies'])
+    def search_movies():
+        fields = get_fields(MOVIE_FIELDS)
+        result, next_cursor = search_page(Movie)
+        return entities_response(Movie, "movies", result, fields, next_cursor=next_cursor)
+
+    @app.route('/stats', methods=['GET'])
+    @requires_auth('get:actors', 'get:movies')
+    @response_cache.cached('get:movies', lambda: ['actors', 'movies'])
+    def get_stats():
+        stats = CatalogStats.query.get(1)
+        if stats is None:
+            adjust_stats()
+            db.session.commit()
+            stats = CatalogStats.query.get(1)
+        # Both maxima are read from the end of the count indexes.
+        max_movies = db.session.query(db.func.max(Actor.movie_count)).scalar()
+        max_cast = db.session.query(db.func.max(Movie.actor_count)).scalar()
         return jsonify({
             "success": True,
-            "actors": actors
+            "actors": stats.actors,
+            "movies": stats.movies,
+            "links": stats.links,
+            "movies_per_actor": round(stats.links / stats.actors, 2) if stats.actors else 0,
+            "cast_size": round(stats.links / stats.movies, 2) if stats.movies else 0,
+            "max_movies_per_actor": max_movies or 0,
+            "max_cast_size": max_cast or 0
         })
 
     @app.route('/actors/<int:actor_id>', methods=['GET'])
     @requires_auth('get:actors')
+    @response_cache.cached('get:actors', lambda actor_id: [f'actor:{actor_id}'])
     def get_actor(actor_id):
         actor = Actor.query.get(actor_id)
         if actor is None:
             abort(404)
+        return entity_response(Actor, "actor", actor)
+
+    @app.route('/actors/<int:actor_id>/costars', methods=['GET'])
+    @requires_auth('get:actors')
+    @response_cache.cached('get:actors', lambda actor_id: ['actors', 'movies'])
+    def get_costars(actor_id):
+        if not existing_ids(Actor, [actor_id]):
+            abort(404)
+        fields = get_fields(ACTOR_FIELDS)
+        ranked, next_cursor = slice_page(get_graph().costars(actor_id))
+        shared = dict(ranked)
+        costars = entity_dicts(Actor, fetch_records(Actor, list(shared), fields), fields)
+        for item in costars:
+            item['shared_movies'] = shared[item['id']]
         return jsonify({
             "success": True,
-            "actor": actor.get_actor()
+            "costars": costars,
+            "next_cursor": next_cursor
+        })
+
+    @app.route('/actors/<int:actor_id>/path/<int:other_id>', methods=['GET'])
+    @requires_auth('get:actors', 'get:movies')
+    @response_cache.cached('get:movies', lambda actor_id, other_id: ['actors', 'movies'])
+    def get_actor_path(actor_id, other_id):
+        max_depth = get_int_arg('max_depth')
+        if max_depth is None:
+            max_depth = MAX_PATH_DEPTH
+        if not 1 <= max_depth <= MAX_PATH_DEPTH:
+            abort(400)
+        if len(existing_ids(Actor, {actor_id, other_id})) < len({actor_id, other_id}):
+            abort(404)
+        actor_ids, movie_ids = get_graph().path(actor_id, other_id, max_depth) or ([], [])
+        return jsonify({
+            "success": True,
+            "degrees": len(movie_ids) if actor_ids else None,
+            "actor_ids": actor_ids,
+            "movie_ids": movie_ids
         })
 
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @idempotent
     def create_actor():
         body = request.get_json()
         if not body:
@@ -116,17 +348,18 @@ def create_app(test_config=None):
         try:
             actor = Actor(name=name, age=age, gender=gender)
             db.session.add(actor)
+            text_changed(Actor)
+            adjust_stats(actors=1)
             db.session.commit()
-            return jsonify({
-                "success": True,
-                "actor": actor.get_actor()
-            })
+            actors_changed()
+            return entity_response(Actor, "actor", actor)
         except:
             db.session.rollback()
             abort(422)
 
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
+    @idempotent
     def update_actor(actor_id):
         body = request.get_json()
         if not body:
@@ -137,33 +370,25 @@ def create_app(test_config=None):
         actor = Actor.query.get(actor_id)
         if actor is None:
             abort(404)
-        try:
-            if name:
-                actor.name = name
-            if age:
-                actor.age = age
-            if gender:
-                actor.gender = gender
-            db.session.commit()
-            return jsonify({
-                "success": True,
-                "actor": actor.get_actor()
-            })
-        except:
-            db.session.rollback()
-            abort(422)
+        check_if_match(Actor, actor)
+        values = {'name': name, 'age': age, 'gender': gender}
+        actor = save_row(Actor, actor, {key: value for key, value in values.items() if value})
+        actors_changed([actor_id])
+        return entity_response(Actor, "actor", actor)
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
+    @idempotent
     def delete_actor(actor_id):
         actor = Actor.query.get(actor_id)
         if actor is None:
             abort(404)
+        check_if_match(Actor, actor, claim=True)
         try:
-            for movie in actor.movies:
-                movie.actors.remove(actor)
-            db.session.delete(actor)
+            movie_ids = bulk_delete(Actor, [actor.id])
             db.session.commit()
+            actors_changed([actor_id])
+            movies_changed(movie_ids)
             return jsonify({
                 "success": True
             })
@@ -173,31 +398,27 @@ def create_app(test_config=None):
 
     @app.route('/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @response_cache.cached('get:movies', lambda: ['movies'])
     def get_movies():
-        result = Movie.query.all()
+        fields = get_fields(MOVIE_FIELDS)
+        result, next_cursor = paginate_records(Movie, movie_filters(request.args), fields,
+                                               *get_sort(MOVIE_SORTS))
         if not result:
             abort(404)
-        movies = []
-        for movie in result:
-            movies.append(movie.get_movie())
-        return jsonify({
-            "success": True,
-            "movies": movies
-        })
+        return entities_response(Movie, "movies", result, fields, next_cursor=next_cursor)
 
     @app.route('/movies/<int:movie_id>', methods=['GET'])
     @requires_auth('get:movies')
+    @response_cache.cached('get:movies', lambda movie_id: [f'movie:{movie_id}'])
     def get_movie(movie_id):
         movie = Movie.query.get(movie_id)
         if movie is None:
             abort(404)
-        return jsonify({
-            "success": True,
-            "movie": movie.get_movie()
-        })
+        return entity_response(Movie, "movie", movie)
 
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @idempotent
     def create_movie():
         body = request.get_json()
         title = body.get('title')
@@ -208,11 +429,11 @@ def create_app(test_config=None):
             release_date = datetime.fromisoformat(release_date_str)
             movie = Movie(title=title, release_date=release_date)
             db.session.add(movie)
+            text_changed(Movie)
+            adjust_stats(movies=1)
             db.session.commit()
-            return jsonify({
-                "success": True,
-                "movie": movie.get_movie()
-            })
+            movies_changed()
+            return entity_response(Movie, "movie", movie)
         except ValueError:
             abort(400, description="Invalid date format. Use ISO 8601 format e.g., '2023-09-28T14:30:00")
         except:
@@ -221,6 +442,7 @@ def create_app(test_config=None):
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
+    @idempotent
     def update_movie(movie_id):
         body = request.get_json()
         title = body.get('title')
@@ -228,34 +450,32 @@ def create_app(test_config=None):
         movie = Movie.query.get(movie_id)
         if movie is None:
             abort(404)
-        try:
-            if title:
-                movie.title = title
-            if release_date_str:
-                movie.release_date = datetime.fromisoformat(release_date_str)
-            db.session.commit()
-            return jsonify({
-                "success": True,
-                "movie": movie.get_movie()
-            })
-
-        except ValueError:
-            abort(400, description="Invalid date format. Use ISO 8601 format e.g., '2023-09-28T14:30:00")
-        except:
-            db.session.rollback()
-            abort(422)
+        check_if_match(Movie, movie)
+        values = {}
+        if title:
+            values['title'] = title
+        if release_date_str:
+            try:
+                values['release_date'] = datetime.fromisoformat(release_date_str)
+            except ValueError:
+                abort(400, description="Invalid date format. Use ISO 8601 format e.g., '2023-09-28T14:30:00")
+        movie = save_row(Movie, movie, values)
+        movies_changed([movie_id])
+        return entity_response(Movie, "movie", movie)
 
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
+    @idempotent
     def delete_movie(movie_id):
         movie = Movie.query.get(movie_id)
         if movie is None:
             abort(404)
+        check_if_match(Movie, movie, claim=True)
         try:
-            for actor in movie.actors:
-                actor.movies.remove(movie)
-            db.session.delete(movie)
+            actor_ids = bulk_delete(Movie, [movie.id])
             db.session.commit()
+            movies_changed([movie_id])
+            actors_changed(actor_ids)
             return jsonify({
                 "success": True
             })
@@ -265,28 +485,193 @@ def create_app(test_config=None):
 
     @app.route('/movies/<int:movie_id>/actors', methods=['PATCH'])
     @requires_auth('patch:movies')
+    @idempotent
     def link_movie_to_actors(movie_id):
         movie = Movie.query.get(movie_id)
         if not movie:
             abort(404)
+        check_if_match(Movie, movie, claim=True)
 
-        body = request.get_json()
-        actor_ids = body.get('actor_ids', [])
+        requested = existing_ids(Actor, get_actor_ids())
         try:
-            movie.actors.clear()
-            for actor_id in actor_ids:
-                actor = Actor.query.get(actor_id)
-                if actor:
-                    movie.actors.append(actor)
+            current = linked_actor_ids(movie.id)
+            add_links(movie.id, requested - current)
+            remove_links(movie.id, current - requested)
             db.session.commit()
-            return jsonify({
-                "success": True,
-                "movie": movie.get_movie()
-            })
+            movies_changed([movie_id])
+            actors_changed(requested ^ current)
+            return entity_response(Movie, "movie", movie)
         except:
             db.session.rollback()
             abort(422)
 
+    @app.route('/movies/<int:movie_id>/actors', methods=['POST'])
+    @requires_auth('patch:movies')
+    @idempotent
+    def add_actors_to_movie(movie_id):
+        movie = Movie.query.get(movie_id)
+        if not movie:
+            abort(404)
+        check_if_match(Movie, movie, claim=True)
+
+        requested = existing_ids(Actor, get_actor_ids())
+        try:
+            added = requested - linked_actor_ids(movie.id)
+            add_links(movie.id, added)
+            db.session.commit()
+            movies_changed([movie_id])
+            actors_changed(added)
+            return entity_response(Movie, "movie", movie)
+        except:
+            db.session.rollback()
+            abort(422)
+
+    @app.route('/movies/<int:movie_id>/actors', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    @idempotent
+    def remove_actors_from_movie(movie_id):
+        movie = Movie.query.get(movie_id)
+        if not movie:
+            abort(404)
+        check_if_match(Movie, movie, claim=True)
+
+        actor_ids = get_actor_ids()
+        try:
+            removed = linked_actor_ids(movie.id) & set(actor_ids)
+            remove_links(movie.id, removed)
+            db.session.commit()
+            movies_changed([movie_id])
+            actors_changed(removed)
+            return entity_response(Movie, "movie", movie)
+        except:
+            db.session.rollback()
+            abort(422)
+
+    @app.route('/actors/batch', methods=['POST'])
+    @requires_auth('post:actors')
+    @idempotent
+    def create_actors():
+        rows = validate_batch(get_batch_body('actors'), validate_actor,
+                              app.config['BATCH_MAX_SIZE'])
+        try:
+            ids = bulk_insert(Actor, rows)
+            db.session.commit()
+            actors_changed()
+        except:
+            db.session.rollback()
+            abort(422)
+        return batch_response(Actor, ids, "actors")
+
+    @app.route('/actors/batch', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    @idempotent
+    def update_actors():
+        rows = validate_batch(get_batch_body('actors'), validate_actor,
+                              app.config['BATCH_MAX_SIZE'], partial=True)
+        ids = [row['id'] for row in rows]
+        require_existing(Actor, ids)
+        try:
+            bulk_update(Actor, rows)
+            db.session.commit()
+            actors_changed(ids)
+        except:
+            db.session.rollback()
+            abort(422)
+        return batch_response(Actor, ids, "actors")
+
+    @app.route('/actors/batch', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    @idempotent
+    def delete_actors():
+        ids = validate_ids(get_batch_body('ids'), app.config['BATCH_MAX_SIZE'])
+        require_existing(Actor, ids)
+        try:
+            movie_ids = bulk_delete(Actor, ids)
+            db.session.commit()
+            actors_changed(ids)
+            movies_changed(movie_ids)
+        except:
+            db.session.rollback()
+            abort(422)
+        return jsonify({
+            "success": True,
+            "deleted": ids
+        })
+
+    @app.route('/movies/batch', methods=['POST'])
+    @requires_auth('post:movies')
+    @idempotent
+    def create_movies():
+        rows = validate_batch(get_batch_body('movies'), validate_movie,
+                              app.config['BATCH_MAX_SIZE'])
+        try:
+            ids = bulk_insert(Movie, rows)
+            db.session.commit()
+            movies_changed()
+        except:
+            db.session.rollback()
+            abort(422)
+        return batch_response(Movie, ids, "movies")
+
+    @app.route('/movies/batch', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    @idempotent
+    def update_movies():
+        rows = validate_batch(get_batch_body('movies'), validate_movie,
+                              app.config['BATCH_MAX_SIZE'], partial=True)
+        ids = [row['id'] for row in rows]
+        require_existing(Movie, ids)
+        try:
+            bulk_update(Movie, rows)
+            db.session.commit()
+            movies_changed(ids)
+        except:
+            db.session.rollback()
+            abort(422)
+        return batch_response(Movie, ids, "movies")
+
+    @app.route('/movies/batch', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    @idempotent
+    def delete_movies():
+        ids = validate_ids(get_batch_body('ids'), app.config['BATCH_MAX_SIZE'])
+        require_existing(Movie, ids)
+        try:
+            actor_ids = bulk_delete(Movie, ids)
+            db.session.commit()
+            movies_changed(ids)
+            actors_changed(actor_ids)
+        except:
+            db.session.rollback()
+            abort(422)
+        return jsonify({
+            "success": True,
+            "deleted": ids
+        })
+
+    @app.route('/changes', methods=['GET'])
+    @requires_auth('get:actors', 'get:movies')
+    def get_changes():
+        # A replica behind the settle window would let the cursor skip changes.
+        replicas.use_primary()
+        result, next_cursor, has_more = changes_page()
+        return jsonify({
+            "success": True,
+            "changes": result,
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        })
+
+    @app.route('/export/actors', methods=['GET'])
+    @requires_auth('get:actors')
+    def export_actors():
+        return ndjson_response(export_query(Actor), partial(entity_dicts, Actor))
+
+    @app.route('/export/movies', methods=['GET'])
+    @requires_auth('get:movies')
+    def export_movies():
+        return ndjson_response(export_query(Movie), partial(entity_dicts, Movie))
+
 
     @app.errorhandler(422)
     def unprocessable(error):
@@ -296,6 +681,30 @@ def create_app(test_config=None):
             "message": "unprocessable"
         }), 422)
 
+    @app.errorhandler(410)
+    def gone(error):
+        return (jsonify({
+            "success": False,
+            "error": 410,
+            "message": "Gone"
+        }), 410)
+
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return (jsonify({
+            "success": False,
+            "error": 412,
+            "message": "Precondition failed"
+        }), 412)
+
+    @app.errorhandler(409)
+    def conflict(error):
+        return (jsonify({
+            "success": False,
+            "error": 409,
+            "message": "Conflict"
+        }), 409)
+
     @app.errorhandler(404)
     def not_found(error):
         return (jsonify({
@@ -336,6 +745,15 @@ def create_app(test_config=None):
             "message": "Method not allowed."
         }), 403)
 
+    @app.errorhandler(BatchError)
+    def handle_batch_error(e):
+        return (jsonify({
+            "success": False,
+            "error": e.status_code,
+            "message": "Bad Request" if e.status_code == 400 else "Resource not found",
+            "errors": e.errors
+        }), e.status_code)
+
     @app.errorhandler(AuthError)
     def handle_auth_error(e):
         response = jsonify(e.error)
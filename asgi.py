@@ -0,0 +1,220 @@
+"""ASGI entry point serving the casting API from an event loop.
+
+Run with ``uvicorn asgi:app``. Routing uses the url map built by
+``create_app``, so the routes are defined once. The OAuth callback is
+served natively on an async HTTP client, since it spends its time waiting
+on the identity provider. Every other route runs the regular Flask view
+in a thread pool, so responses, caching, timings and replica routing are
+the same under either server.
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import httpx
+from flask import redirect, session, url_for
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+from werkzeug.wrappers import Request
+
+from app import create_app
+from http_client import CircuitOpenError, identity_client
+
+
+def build_environ(scope, body):
+    headers = scope['headers']
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = b''
+    more = True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+    return body
+
+
+_END = object()
+
+
+class AsyncCastingApp:
+
+    def __init__(self, flask_app=None):
+        self.flask_app = flask_app or create_app()
+        self.executor = ThreadPoolExecutor(int(os.getenv('ASGI_THREADS', '40')))
+        self.http = None
+        self.handlers = {'callback': self.callback}
+
+    async def startup(self):
+        if self.http is None:
+            self.http = identity_client.async_client()
+
+    async def shutdown(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        adapter = self.flask_app.url_map.bind('localhost')
+        try:
+            endpoint, view_args = adapter.match(scope['path'], scope['method'])
+        except (NotFound, MethodNotAllowed, RequestRedirect):
+            endpoint, view_args = None, None
+
+        body = await read_body(receive)
+        handler = self.handlers.get(endpoint)
+        if handler is None:
+            return await self.call_wsgi(scope, body, send)
+
+        await self.startup()
+        request = Request(build_environ(scope, body))
+        try:
+            status, headers, content = await handler(request, **view_args)
+        except HTTPException as e:
+            status, headers, content = await self.render_error(request, e)
+        await self.send_response(send, status, headers, content, request)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, body, send):
+        environ = build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        iterable = await loop.run_in_executor(self.executor, self.flask_app, environ,
+                                              start_response)
+        iterator = iter(iterable)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in started['headers']],
+            })
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await loop.run_in_executor(self.executor, iterable.close)
+
+    async def send_response(self, send, status, headers, content, request):
+        if request.headers.get('Origin'):
+            headers = headers + [('Access-Control-Allow-Origin', '*')]
+        content = content or b''
+        headers = headers + [('Content-Length', str(len(content)))]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def render_error(self, request, error):
+        # Errors go through the Flask error handlers so their bodies match.
+        def render():
+            with self.flask_app.request_context(request.environ):
+                try:
+                    raise error
+                except type(error) as e:
+                    response = self.flask_app.make_response(
+                        self.flask_app.handle_user_exception(e))
+                return response.status_code, list(response.headers.items()), response.get_data()
+
+        status, headers, content = await asyncio.get_running_loop().run_in_executor(
+            self.executor, render)
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        return status, headers, content
+
+    def json(self, data):
+        body = self.flask_app.extensions['json_provider'].dumps(data) + '\n'
+        return (200, [('Content-Type', self.flask_app.config['JSONIFY_MIMETYPE'])],
+                body.encode('utf-8'))
+
+    async def callback(self, request):
+        config = self.flask_app.config
+        code = request.args.get('code')
+        if not code:
+            status, headers, body = self.json({'error': 'Authorization code not found'})
+            return 400, headers, body
+
+        try:
+            res = await identity_client.request_async(
+                self.http, 'POST', config['AUTH0_TOKEN_URL'], data={
+                    'client_id': config['CLIENT_ID'],
+                    'client_secret': config['CLIENT_SECRET'],
+                    'code': code,
+                    'grant_type': 'authorization_code',
+                    'redirect_uri': config['REDIRECT_URI'],
+                })
+        except (httpx.HTTPError, CircuitOpenError):
+            status, headers, body = self.json({'error': 'Identity provider unavailable'})
+            return 503, headers, body
+        if res.status_code != 200:
+            status, headers, body = self.json({'error': 'Failed to obtain access token'})
+            return 400, headers, body
+
+        access_token = res.json().get('access_token')
+        with self.flask_app.request_context(request.environ):
+            session['access_token'] = access_token
+            response = redirect(url_for('dashboard'))
+            self.flask_app.session_interface.save_session(self.flask_app, session, response)
+        return response.status_code, list(response.headers.items()), response.get_data()
+
+
+app = AsyncCastingApp()
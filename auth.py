@@ -1,12 +1,50 @@
-import json
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort, jsonify
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from http_client import identity_client
+from instrumentation import phase
+from jwks import JWKSKeyStore, JWKSFetchError, LocalKeyPair
+from metrics import Gauge
 
 AUTH0_DOMAIN = 'dev-tool.eu.auth0.com'
 ALGORITHMS = ['RS256']
-API_AUDIENCE = 'casting'
+API_AUDIENCE = os.getenv('API_AUDIENCE', 'casting')
+JWT_ISSUER = os.getenv('JWT_ISSUER', f'https://{AUTH0_DOMAIN}/')
+JWKS_URL = os.getenv('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+
+def make_key_provider(source=None):
+    """Build the signing key source named by ``source`` (or ``AUTH_KEY_SOURCE``).
+
+    ``remote`` fetches the JWKS at ``JWKS_URL``, ``file`` reads the JWKS
+    document at ``JWKS_FILE`` and ``local`` verifies against the RSA key in
+    ``AUTH_PRIVATE_KEY_FILE``, or a key generated at startup, so tokens
+    minted with ``tokens.py`` are accepted without any network.
+    """
+    source = source or os.getenv('AUTH_KEY_SOURCE', 'remote')
+    if source == 'remote':
+        return JWKSKeyStore(JWKS_URL, algorithm=ALGORITHMS[0],
+                            ttl=int(os.getenv('JWKS_TTL', '600')),
+                            client=identity_client)
+    if source == 'file':
+        return JWKSKeyStore('file://' + os.path.abspath(os.environ['JWKS_FILE']),
+                            algorithm=ALGORITHMS[0], background_refresh=False)
+    if source == 'local':
+        path = os.getenv('AUTH_PRIVATE_KEY_FILE')
+        kid = os.getenv('AUTH_KEY_ID', 'local')
+        if path:
+            return LocalKeyPair.from_file(path, kid=kid, algorithm=ALGORITHMS[0])
+        return LocalKeyPair(kid=kid, algorithm=ALGORITHMS[0])
+    raise ValueError(f'Unknown AUTH_KEY_SOURCE {source!r}')
+
+
+key_provider = make_key_provider()
 
 
 class AuthError(Exception):
@@ -15,8 +53,96 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+REJECTED = object()
+
+
+class TokenCache:
+    """Bounded LRU of verified token payloads, keyed by a SHA-256 of the token.
+
+    Verified payloads are kept until the token's ``exp`` claim, rejected
+    tokens for ``negative_ttl`` seconds.
+    """
+
+    def __init__(self, maxsize=10000, negative_ttl=30):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def add(self, token, payload):
+        exp = payload.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        self._put(token, exp, payload)
+
+    def reject(self, token):
+        self._put(token, time.time() + self.negative_ttl, REJECTED)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+    def _put(self, token, expires_at, payload):
+        if self.maxsize <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+token_cache = TokenCache(
+    maxsize=int(os.getenv('TOKEN_CACHE_SIZE', '10000')),
+    negative_ttl=int(os.getenv('TOKEN_CACHE_NEGATIVE_TTL', '30'))
+)
+
+TOKEN_CACHE_LOOKUPS = Gauge(
+    'token_cache_lookups', 'Token cache lookups since start or the last clear.',
+    lambda: [({'result': 'hit'}, token_cache.hits), ({'result': 'miss'}, token_cache.misses)],
+    ['result'])
+TOKEN_CACHE_SIZE = Gauge(
+    'token_cache_size', 'Tokens held in the token cache.',
+    lambda: [({}, token_cache.stats()['size'])])
+
+
 def get_token_auth_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+def parse_auth_header(auth):
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -56,25 +182,21 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        with phase('jwks'):
+            rsa_key = key_provider.get_key(unverified_header['kid'])
+    except JWKSFetchError:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -82,7 +204,7 @@ def verify_decode_jwt(token):
                 rsa_key,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer=JWT_ISSUER
             )
 
             return payload
@@ -109,16 +231,38 @@ def verify_decode_jwt(token):
     }, 400)
 
 
-def requires_auth(permission=''):
+def verify_and_cache(token):
+    try:
+        payload = verify_decode_jwt(token)
+    except AuthError as e:
+        # An unreachable key endpoint says nothing about the token: answer
+        # 503 so that clients keep their credentials, and cache nothing.
+        if e.status_code == 503:
+            raise
+        token_cache.reject(token)
+        abort(401)
+    except:
+        token_cache.reject(token)
+        abort(401)
+    token_cache.add(token, payload)
+    return payload
+
+
+def requires_auth(*permissions):
+    """Require a valid token carrying every one of ``permissions``."""
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                abort(401)
-            check_permissions(permission, payload)
+            with phase('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is REJECTED:
+                    abort(401)
+                if payload is None:
+                    payload = verify_and_cache(token)
+                for permission in permissions:
+                    check_permissions(permission, payload)
+                _request_ctx_stack.top.current_user = payload
             return f(*args, **kwargs)
 
         return wrapper
@@ -0,0 +1,161 @@
+"""Compare the sync (gunicorn) and async (uvicorn) serving modes.
+
+Seeds a SQLite database, mints a token with a throwaway RSA key whose
+JWKS the servers read from disk, starts each server in turn and drives the
+read endpoints at a fixed concurrency. Prints one JSON document with
+requests per second and p50/p99 latency per mode.
+
+    python benchmarks/asgi_vs_wsgi.py --concurrency 200 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jwks import LocalKeyPair  # noqa: E402
+from tokens import ROLES, mint_token  # noqa: E402
+
+PATHS = ('/actors?limit=50', '/movies?limit=50', '/actors/1', '/movies/1')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed(env, rows):
+    code = f"""
+from datetime import datetime
+from app import create_app, db
+from models import Actor, Movie
+create_app('testing')
+actors = [Actor(name=f'Actor {{i}}', age=20 + i % 50, gender='Female') for i in range({rows})]
+movies = [Movie(title=f'Movie {{i}}', release_date=datetime(2000 + i % 25, 1, 1))
+          for i in range({rows})]
+for i, movie in enumerate(movies):
+    movie.actors = [actors[(i + k) % {rows}] for k in range(5)]
+db.session.add_all(actors + movies)
+db.session.commit()
+"""
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+
+def start_server(mode, env, port, workers):
+    if mode == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', 'app:app',
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app',
+                   '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--no-access-log']
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def drive(base_url, token, concurrency, duration):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits,
+                                 timeout=30) as client:
+        stop_at = time.perf_counter() + duration
+
+        async def worker(offset):
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(PATHS[i % len(PATHS)])
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+                i += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--database-url',
+                        help='empty database to seed; defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        keys = LocalKeyPair()
+        jwks_path = os.path.join(workdir, 'jwks.json')
+        with open(jwks_path, 'w') as f:
+            json.dump(keys.jwks(), f)
+        env = dict(os.environ,
+                   DATABASE_URL=args.database_url or
+                   'sqlite:///' + os.path.join(workdir, 'bench.db'),
+                   AUTH_KEY_SOURCE='file',
+                   JWKS_FILE=jwks_path,
+                   DB_SCHEMA_MODE='create',
+                   CACHE_BACKEND='none')
+        seed(env, args.rows)
+        token = mint_token(keys, ROLES['casting_assistant'])
+
+        results = {'rows': args.rows, 'concurrency': args.concurrency,
+                   'workers': args.workers, 'started_at': datetime.utcnow().isoformat()}
+        for mode in args.modes.split(','):
+            port = free_port()
+            process = start_server(mode, env, port, args.workers)
+            try:
+                results[mode] = asyncio.run(drive(f'http://127.0.0.1:{port}', token,
+                                                  args.concurrency, args.duration))
+            finally:
+                process.terminate()
+                process.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Compare optimistic versioning with row locks under write contention.
+
+``--threads`` writers each apply ``--updates`` read-modify-write
+increments to the ages of ``--rows`` hot actors, pausing ``--think-ms``
+between the read and the write the way a request handler does, with:
+
+- ``optimistic``: the ``version`` column (what PATCH relies on); a write
+  that lost the race raises ``StaleDataError`` and is retried
+- ``pessimistic``: the row is locked when read (``SELECT ... FOR UPDATE``
+  on PostgreSQL, ``BEGIN IMMEDIATE`` on SQLite, which has no row locks)
+- ``unguarded``: plain read then write, to show the lost updates the
+  other two prevent
+
+Prints the updates per second, retries and lost updates of each as JSON.
+Uses a temporary SQLite file unless ``--database-url`` is given; on
+PostgreSQL the locks are per row, so try ``--rows`` above 1 there too.
+
+    python benchmarks/contention.py --threads 8 --updates 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+
+def make_engine(url, immediate=False):
+    from sqlalchemy import create_engine, event
+    if not url.startswith('sqlite'):
+        return create_engine(url, pool_size=32, max_overflow=32)
+    engine = create_engine(url, connect_args={'timeout': 60, 'check_same_thread': False})
+    if immediate:
+        @event.listens_for(engine, 'connect')
+        def manual_transactions(dbapi_connection, record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin_immediate(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+    return engine
+
+
+def optimistic(session, actor_id, think):
+    from sqlalchemy.orm.exc import StaleDataError
+    from models import Actor
+    retries = 0
+    while True:
+        actor = session.get(Actor, actor_id, populate_existing=True)
+        time.sleep(think)
+        actor.age += 1
+        try:
+            session.commit()
+            return retries
+        except StaleDataError:
+            session.rollback()
+            retries += 1
+
+
+def pessimistic(session, actor_id, think):
+    from models import Actor
+    actor = session.get(Actor, actor_id, populate_existing=True, with_for_update=True)
+    time.sleep(think)
+    actor.age += 1
+    session.commit()
+    return 0
+
+
+def unguarded(session, actor_id, think):
+    from models import Actor
+    table = Actor.__table__
+    age = session.execute(table.select().where(table.c.id == actor_id)).one().age
+    time.sleep(think)
+    session.execute(table.update().where(table.c.id == actor_id).values(age=age + 1))
+    session.commit()
+    return 0
+
+
+def run(engine, strategy, args):
+    from sqlalchemy.orm import Session
+    from models import Actor
+    table = Actor.__table__
+    with engine.begin() as conn:
+        conn.execute(table.update().values(age=0, version=1))
+    retries = []
+    think = args.think_ms / 1000
+
+    def writer(seed):
+        rng = random.Random(seed)
+        count = 0
+        with Session(engine) as session:
+            for _ in range(args.updates):
+                count += strategy(session, rng.randint(1, args.rows), think)
+        retries.append(count)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    with engine.connect() as conn:
+        applied = conn.execute(table.select()).all()
+    total = args.threads * args.updates
+    return {
+        'seconds': round(seconds, 3),
+        'updates_per_second': int(total / seconds),
+        'retries': sum(retries),
+        'lost_updates': total - sum(row.age for row in applied),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=1)
+    parser.add_argument('--think-ms', type=float, default=1.0)
+    parser.add_argument('--database-url',
+                        help='empty database to use; defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from models import db, Actor
+    engine = make_engine(url)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Actor.__table__.insert(), [
+            {'name': f'Actor {i}', 'age': 0, 'gender': 'Female'} for i in range(args.rows)])
+
+    results = {
+        'optimistic': run(engine, optimistic, args),
+        'pessimistic': run(make_engine(url, immediate=engine.dialect.name == 'sqlite'),
+                           pessimistic, args),
+        'unguarded': run(engine, unguarded, args),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark the co-star graph behind /actors/<id>/costars and /actors/<a>/path/<b>.
+
+Builds a ``CostarGraph`` from ``--edges`` random actor-movie links (one
+million by default), with actor popularity following a power law so
+that a few actors have long filmographies, then times ``--queries``
+costar rankings, shortest path searches and link updates on random
+actors. Prints build time, index memory and p50/p95/p99 latencies as
+JSON.
+
+    python benchmarks/costars.py
+    python benchmarks/costars.py --edges 5000000 --actors 1000000 --movies 500000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from graph import CostarGraph  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def edges(actors, movies, count, rng):
+    weights = [rng.paretovariate(1.5) for _ in range(actors)]
+    actor_ids = rng.choices(range(1, actors + 1), weights=weights, k=count)
+    seen = set()
+    for actor_id in actor_ids:
+        edge = (actor_id, rng.randint(1, movies))
+        if edge not in seen:
+            seen.add(edge)
+            yield edge
+
+
+def timed(queries, run):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        run(query)
+        latencies.append(time.perf_counter() - started)
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--actors', type=int, default=200000)
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--max-depth', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    links = list(edges(args.actors, args.movies, args.edges, rng))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    graph = CostarGraph(links)
+    build_seconds = time.perf_counter() - started
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    actor_ids = list(graph.movies_of)
+    pairs = [(rng.choice(actor_ids), rng.choice(actor_ids)) for _ in range(args.queries)]
+    updates = [(rng.choice(actor_ids), rng.randint(1, args.movies))
+               for _ in range(args.queries)]
+    found = []
+
+    def path(pair):
+        found.append(graph.path(*pair, max_depth=args.max_depth) is not None)
+
+    def update(edge):
+        graph.add(*edge)
+        graph.remove(*edge)
+
+    results = {
+        'actors': len(graph.movies_of),
+        'movies': len(graph.actors_of),
+        'edges': graph.edges,
+        'build_seconds': round(build_seconds, 3),
+        'index_mb': round(index_bytes / 2 ** 20, 1),
+        'costars': timed([pair[0] for pair in pairs], graph.costars),
+        'path': timed(pairs, path),
+        'paths_found': sum(found),
+        'add_remove_link': timed(updates, update),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
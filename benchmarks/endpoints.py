@@ -0,0 +1,409 @@
+"""Benchmark every route registered by ``create_app``.
+
+Seeds the database with ``--actors`` actors and ``--movies`` movies, each
+movie linked to ``--fanout`` actors on average, then sends ``--requests``
+requests to each route from ``--concurrency`` threads through the WSGI
+app. Records throughput, p50/p95/p99 latency and SQL statements per
+request, and writes them to ``--output`` as JSON.
+
+With ``--baseline`` the run is compared to an earlier result file and
+exits with status 1 when a route got slower than ``--max-regression``
+allows at p95, or runs more SQL statements per request than before.
+
+    python benchmarks/endpoints.py --actors 100000 --movies 100000 --output bench.json
+    python benchmarks/endpoints.py --baseline bench.json --output new.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BATCH = 50
+# Routes that need something outside the app (the Auth0 redirect flow,
+# files on disk) and are not driven.
+SKIPPED = {'callback', 'static'}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Scenario:
+    """One route to drive.
+
+    ``build(context, rng, i)`` returns the path and JSON body of the
+    ``i``-th request. ``prepare(context, count)`` runs untimed before
+    the requests, e.g. to insert the rows a delete will consume.
+    """
+
+    def __init__(self, endpoint, method, build, role='executive_producer', status=200,
+                 prepare=None, share=1.0, name=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.build = build
+        self.role = role
+        self.status = status
+        self.prepare = prepare
+        self.share = share
+        self.name = name or endpoint
+
+
+def actor_body(rng):
+    return {'name': f'Actor {rng.randrange(10 ** 9)}', 'age': rng.randint(18, 90),
+            'gender': rng.choice(('Female', 'Male'))}
+
+
+def movie_body(rng):
+    return {'title': f'Movie {rng.randrange(10 ** 9)}',
+            'release_date': f'{rng.randint(1950, 2030)}-0{rng.randint(1, 9)}-15T00:00:00'}
+
+
+def reserve(model_name, per_request):
+    """Insert rows for delete scenarios and hand them out per request."""
+    def prepare(context, count):
+        from models import Actor, Movie
+        model = {'actor': Actor, 'movie': Movie}[model_name]
+        rng = random.Random(count)
+        body = actor_body if model is Actor else movie_body
+        rows = [body(rng) for _ in range(count * per_request)]
+        if model is Movie:
+            for row in rows:
+                row['release_date'] = datetime.fromisoformat(row['release_date'])
+        context[f'reserved_{model_name}'] = insert_rows(model.__table__, rows)
+    return prepare
+
+
+def poll_cursor(context, count):
+    """A /changes cursor that has caught up, for the empty-poll scenario."""
+    from changes import END, encode_since
+    now = datetime.utcnow()
+    context['changes_cursor'] = encode_since(now, END, [], now)
+
+
+def reserved(context, model_name, i, per_request):
+    ids = context[f'reserved_{model_name}']
+    return ids[i * per_request:(i + 1) * per_request]
+
+
+SCENARIOS = [
+    Scenario('get_greeting', 'GET', lambda c, rng, i: ('/', None)),
+    Scenario('get_metrics', 'GET', lambda c, rng, i: ('/metrics', None)),
+    Scenario('login', 'GET', lambda c, rng, i: ('/login', None), status=302),
+    Scenario('dashboard', 'GET', lambda c, rng, i: ('/dashboard', None), status=302),
+
+    Scenario('get_actors', 'GET', lambda c, rng, i: ('/actors?limit=100', None),
+             role='casting_assistant'),
+    Scenario('get_actors', 'GET',
+             lambda c, rng, i: (f'/actors?gender=Female&age_min={rng.randint(18, 60)}', None),
+             role='casting_assistant', name='get_actors_filtered'),
+    Scenario('get_actor', 'GET', lambda c, rng, i: (f'/actors/{rng.choice(c["actors"])}', None),
+             role='casting_assistant'),
+    Scenario('create_actor', 'POST', lambda c, rng, i: ('/actors', actor_body(rng))),
+    Scenario('update_actor', 'PATCH',
+             lambda c, rng, i: (f'/actors/{rng.choice(c["actors"])}',
+                                {'age': rng.randint(18, 90)})),
+    Scenario('delete_actor', 'DELETE',
+             lambda c, rng, i: (f'/actors/{reserved(c, "actor", i, 1)[0]}', None),
+             prepare=reserve('actor', 1)),
+    Scenario('create_actors', 'POST',
+             lambda c, rng, i: ('/actors/batch',
+                                {'actors': [actor_body(rng) for _ in range(BATCH)]}),
+             share=0.2),
+    Scenario('update_actors', 'PATCH',
+             lambda c, rng, i: ('/actors/batch', {'actors': [
+                 {'id': actor_id, 'age': rng.randint(18, 90)}
+                 for actor_id in rng.sample(c['actors'], min(BATCH, len(c['actors'])))]}),
+             share=0.2),
+    Scenario('delete_actors', 'DELETE',
+             lambda c, rng, i: ('/actors/batch', {'ids': reserved(c, 'actor', i, BATCH)}),
+             prepare=reserve('actor', BATCH), share=0.2),
+
+    Scenario('get_movies', 'GET', lambda c, rng, i: ('/movies?limit=100', None),
+             role='casting_assistant'),
+    Scenario('get_movies', 'GET',
+             lambda c, rng, i: (f'/movies?release_date_min={rng.randint(1950, 2020)}-01-01', None),
+             role='casting_assistant', name='get_movies_filtered'),
+    Scenario('get_movie', 'GET', lambda c, rng, i: (f'/movies/{rng.choice(c["movies"])}', None),
+             role='casting_assistant'),
+    Scenario('create_movie', 'POST', lambda c, rng, i: ('/movies', movie_body(rng))),
+    Scenario('update_movie', 'PATCH',
+             lambda c, rng, i: (f'/movies/{rng.choice(c["movies"])}', {'title': f'Movie {i}'})),
+    Scenario('delete_movie', 'DELETE',
+             lambda c, rng, i: (f'/movies/{reserved(c, "movie", i, 1)[0]}', None),
+             prepare=reserve('movie', 1)),
+    Scenario('link_movie_to_actors', 'PATCH',
+             lambda c, rng, i: (f'/movies/{rng.choice(c["movies"])}/actors',
+                                {'actor_ids': rng.sample(c['actors'], min(5, len(c['actors'])))})),
+    Scenario('add_actors_to_movie', 'POST',
+             lambda c, rng, i: (f'/movies/{rng.choice(c["movies"])}/actors',
+                                {'actor_ids': rng.sample(c['actors'], min(3, len(c['actors'])))})),
+    Scenario('remove_actors_from_movie', 'DELETE',
+             lambda c, rng, i: (f'/movies/{rng.choice(c["movies"])}/actors',
+                                {'actor_ids': rng.sample(c['actors'], min(3, len(c['actors'])))})),
+    Scenario('create_movies', 'POST',
+             lambda c, rng, i: ('/movies/batch',
+                                {'movies': [movie_body(rng) for _ in range(BATCH)]}),
+             share=0.2),
+    Scenario('update_movies', 'PATCH',
+             lambda c, rng, i: ('/movies/batch', {'movies': [
+                 {'id': movie_id, 'title': f'Movie {i}'}
+                 for movie_id in rng.sample(c['movies'], min(BATCH, len(c['movies'])))]}),
+             share=0.2),
+    Scenario('delete_movies', 'DELETE',
+             lambda c, rng, i: ('/movies/batch', {'ids': reserved(c, 'movie', i, BATCH)}),
+             prepare=reserve('movie', BATCH), share=0.2),
+
+    Scenario('get_actors', 'GET',
+             lambda c, rng, i: (f'/actors?sort=-movie_count&movie_count_max={rng.randint(1, 10)}',
+                                None),
+             role='casting_assistant', name='get_actors_by_count'),
+    Scenario('get_stats', 'GET', lambda c, rng, i: ('/stats', None), role='casting_assistant'),
+
+    Scenario('get_costars', 'GET',
+             lambda c, rng, i: (f'/actors/{rng.choice(c["actors"])}/costars?limit=20', None),
+             role='casting_assistant'),
+    Scenario('get_actor_path', 'GET',
+             lambda c, rng, i: (f'/actors/{rng.choice(c["actors"])}/path/'
+                                f'{rng.choice(c["actors"])}?max_depth=4', None),
+             role='casting_assistant'),
+
+    Scenario('search_actors', 'GET',
+             lambda c, rng, i: (f'/search/actors?q=actor {rng.randrange(100)}&limit=10', None),
+             role='casting_assistant'),
+    Scenario('search_movies', 'GET',
+             lambda c, rng, i: (f'/search/movies?q=movi {rng.randrange(100)}&limit=10', None),
+             role='casting_assistant'),
+
+    Scenario('get_changes', 'GET', lambda c, rng, i: ('/changes?limit=100', None),
+             role='casting_assistant', name='get_changes_sync'),
+    Scenario('get_changes', 'GET',
+             lambda c, rng, i: (f'/changes?since={c["changes_cursor"]}', None),
+             role='casting_assistant', prepare=poll_cursor, name='get_changes_poll'),
+
+    Scenario('export_actors', 'GET', lambda c, rng, i: ('/export/actors', None), share=0.02),
+    Scenario('export_movies', 'GET', lambda c, rng, i: ('/export/movies', None), share=0.02),
+]
+
+
+def insert_rows(table, rows, chunk_size=10000):
+    from bulk import adjust_stats
+    from models import db
+    ids = []
+    for chunk in chunks(rows, chunk_size):
+        # Ids are assigned contiguously as nothing else writes during seeding.
+        first = db.session.execute(table.insert(), chunk[:1]).inserted_primary_key[0]
+        if len(chunk) > 1:
+            db.session.execute(table.insert(), chunk[1:])
+        ids.extend(range(first, first + len(chunk)))
+    adjust_stats(**{table.name + 's': len(ids)})
+    db.session.commit()
+    return ids
+
+
+def seed(actors, movies, fanout, rng):
+    from bulk import backfill_counts
+    from models import Actor, Movie, actor_movie, db
+    if db.session.query(Actor.id).first() or db.session.query(Movie.id).first():
+        raise SystemExit('The benchmark database must be empty.')
+
+    actor_ids = insert_rows(Actor.__table__, [
+        {'name': f'Actor {i}', 'age': rng.randint(18, 90), 'gender': rng.choice(('Female', 'Male'))}
+        for i in range(actors)])
+    movie_ids = insert_rows(Movie.__table__, [
+        {'title': f'Movie {i}', 'release_date': datetime(rng.randint(1950, 2030), 1, 1)}
+        for i in range(movies)])
+    links = []
+    for movie_id in movie_ids:
+        count = min(len(actor_ids), rng.randint(1, 2 * fanout - 1))
+        links.extend({'movie_id': movie_id, 'actor_id': actor_id}
+                     for actor_id in rng.sample(actor_ids, count))
+    for chunk in chunks(links, 10000):
+        db.session.execute(actor_movie.insert(), chunk)
+    backfill_counts()
+    db.session.commit()
+    db.session.remove()
+    return {'actors': actor_ids, 'movies': movie_ids}
+
+
+class StatementCounter:
+    """Counts the SQL statements run by the current thread."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def run_scenario(app, scenario, context, tokens, requests, concurrency, counter):
+    from models import db
+    count = max(1, int(requests * scenario.share))
+    if scenario.prepare:
+        scenario.prepare(context, count)
+    local = threading.local()
+    headers = {'Authorization': f'Bearer {tokens[scenario.role]}'}
+
+    def send(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        path, body = scenario.build(context, random.Random(i), i)
+        counter.reset()
+        started = time.perf_counter()
+        response = local.client.open(path, method=scenario.method, json=body, headers=headers)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        statements = counter.count
+        db.session.remove()
+        return elapsed, statements, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, range(count)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, _, _ in results]
+    statements = [count for _, count, _ in results]
+    return {
+        'endpoint': scenario.endpoint,
+        'method': scenario.method,
+        'requests': count,
+        'errors': sum(1 for _, _, status in results if status != scenario.status),
+        'rps': round(count / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'sql_per_request': round(sum(statements) / count, 2),
+        'sql_max': max(statements),
+    }
+
+
+def compare(results, baseline, max_regression):
+    failures = []
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+            failures.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['sql_max'] > previous['sql_max']:
+            failures.append(f"{name}: SQL statements {previous['sql_max']} -> {current['sql_max']}")
+    return failures
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=5, help='average actors per movie')
+    parser.add_argument('--requests', type=int, default=500, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--database-url',
+                        help='empty database to seed; defaults to a temporary SQLite file')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed p95 slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = (args.database_url or
+                                  'sqlite:///' + os.path.join(workdir, 'bench.db'))
+    os.environ['DB_SCHEMA_MODE'] = 'create'
+    os.environ['AUTH_KEY_SOURCE'] = 'local'
+    # The seed rows are fresh; list them in the /changes sync right away.
+    os.environ['CHANGES_SETTLE_SECONDS'] = '0'
+    os.environ.pop('AUTH_PRIVATE_KEY_FILE', None)
+    if not args.cache:
+        os.environ['CACHE_BACKEND'] = 'none'
+
+    import auth
+    from app import create_app
+    from models import db
+    from tokens import ROLES, mint_token
+
+    app = create_app()
+    tokens = {role: mint_token(auth.key_provider, permissions, ttl=24 * 3600)
+              for role, permissions in ROLES.items()}
+    context = seed(args.actors, args.movies, args.fanout, random.Random(args.seed))
+    counter = StatementCounter(db.engine)
+
+    scenarios = SCENARIOS
+    if args.only:
+        names = set(args.only.split(','))
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name in names]
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    missing = sorted(endpoints - SKIPPED - {scenario.endpoint for scenario in SCENARIOS})
+
+    results = {
+        'revision': git_revision(),
+        'started_at': datetime.utcnow().isoformat(),
+        'database': db.engine.dialect.name,
+        'actors': args.actors,
+        'movies': args.movies,
+        'fanout': args.fanout,
+        'concurrency': args.concurrency,
+        'not_covered': missing,
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        result = run_scenario(app, scenario, context, tokens, args.requests,
+                              args.concurrency, counter)
+        results['scenarios'][scenario.name] = result
+        print(f"{scenario.name:28} {result['rps']:>9} rps  p50 {result['p50_ms']:>9}ms  "
+              f"p95 {result['p95_ms']:>9}ms  p99 {result['p99_ms']:>9}ms  "
+              f"sql {result['sql_per_request']:>6}  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.max_regression)
+        for failure in failures:
+            print('REGRESSION ' + failure, file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Compare ORM entities with read_models records on the list endpoint path.
+
+Fills a temporary SQLite database (or ``--database-url``) with
+``--rows`` actors and movies, then for each model loads a page of all
+the rows as ORM entities (the path before read_models.py) and as
+records, and encodes it the way ``GET /actors`` and ``GET /movies`` do.
+Prints the memory held per 10k loaded rows and the rows per second of
+loading alone and of loading plus encoding, as JSON.
+
+    python benchmarks/read_models.py --rows 10000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def measure(load, encode, rows, repeat):
+    from models import db
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    loaded = load()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+
+    def load_only():
+        db.session.remove()
+        load()
+
+    def load_and_encode():
+        db.session.remove()
+        encode(load())
+
+    load_seconds = min(timeit.repeat(load_only, number=1, repeat=repeat))
+    total_seconds = min(timeit.repeat(load_and_encode, number=1, repeat=repeat))
+    return {
+        'bytes_per_10k_rows': int(held * 10000 / rows),
+        'load_rows_per_second': int(rows / load_seconds),
+        'load_and_encode_rows_per_second': int(rows / total_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url',
+                        help='empty database to fill; defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = (args.database_url or
+                                  'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    os.environ['DB_SCHEMA_MODE'] = 'create'
+
+    from app import create_app
+    from bulk import backfill_counts
+    from models import db, Actor, Movie, actor_movie
+    from read_models import load_records, record_columns, select_columns
+
+    app = create_app()
+    results = {}
+    with app.app_context():
+        db.session.execute(Actor.__table__.insert(), [
+            {'name': f'Actor {i}', 'age': 20 + i % 60, 'gender': 'Female'}
+            for i in range(args.rows)])
+        db.session.execute(Movie.__table__.insert(), [
+            {'title': f'Movie {i}', 'release_date': datetime(2000 + i % 25, 1, 1)}
+            for i in range(args.rows)])
+        db.session.execute(actor_movie.insert(), [
+            {'actor_id': i, 'movie_id': (i * 7 + k) % args.rows + 1}
+            for i in range(1, args.rows + 1) for k in range(3)])
+        backfill_counts()
+        db.session.commit()
+
+        provider = app.extensions['json_provider']
+        for model in (Actor, Movie):
+            columns = record_columns(model)
+            statement = select_columns(model, columns).order_by(model.id)
+
+            def encode(rows, model=model):
+                provider.encode_entities(model, rows)
+
+            results[model.__tablename__] = {
+                'orm': measure(lambda model=model: model.query.order_by(model.id).all(),
+                               encode, args.rows, args.repeat),
+                'records': measure(lambda model=model: load_records(model, statement, columns),
+                                   encode, args.rows, args.repeat),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Compare the JSON encoding paths of the actor and movie list responses.
+
+Encodes a page of ``--rows`` actors and movies, each with ``--links``
+linked ids, ``--repeat`` times per path and prints the best time and
+rows per second of each:
+
+- ``jsonify``: ``get_actor()``/``get_movie()`` dicts through Flask's encoder
+  (the path before serializers.py)
+- ``compiled``: the compiled per-model encoders, default (RFC 822 date) output
+- ``compiled_iso``: the same in canonical ISO mode with the stdlib encoder
+- ``compiled_iso_orjson``: canonical ISO mode with orjson, when installed
+
+No database is needed; the rows are built in memory.
+
+    python benchmarks/serialization.py --rows 1000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from flask import json as flask_json
+    from app import create_app
+    from models import Actor, Movie
+    import serializers
+    from serializers import Raw
+
+    actors = [Actor(id=i, name=f'Actor {i}', age=20 + i % 60, gender='Female', movie_count=5)
+              for i in range(1, args.rows + 1)]
+    movies = [Movie(id=i, title=f'Movie {i}', release_date=datetime(2000 + i % 25, 1, 1),
+                    actor_count=5)
+              for i in range(1, args.rows + 1)]
+    links = {i: list(range(i, i + args.links)) for i in range(1, args.rows + 1)}
+
+    app = create_app()
+    providers = {'compiled': serializers.make_provider(app)}
+    app.config['JSON_DATE_FORMAT'] = 'iso'
+    app.config['JSON_AS_ASCII'] = False
+    app.config['JSON_ENCODER'] = 'stdlib'
+    providers['compiled_iso'] = serializers.make_provider(app)
+    if serializers.orjson is not None:
+        app.config['JSON_ENCODER'] = 'orjson'
+        providers['compiled_iso_orjson'] = serializers.make_provider(app)
+    app.config.update(JSON_DATE_FORMAT='http', JSON_AS_ASCII=True)
+
+    def jsonify_path():
+        flask_json.dumps({'success': True, 'next_cursor': None,
+                          'actors': [actor.get_actor(links[actor.id]) for actor in actors]},
+                         separators=(',', ':'))
+        flask_json.dumps({'success': True, 'next_cursor': None,
+                          'movies': [movie.get_movie(links[movie.id]) for movie in movies]},
+                         separators=(',', ':'))
+
+    def compiled_path(provider):
+        encode_actor = provider.serializer(Actor)
+        encode_movie = provider.serializer(Movie)
+
+        def run():
+            provider.compose({'success': True, 'next_cursor': None, 'actors': Raw(
+                '[' + ','.join([encode_actor(row, links[row.id]) for row in actors]) + ']')})
+            provider.compose({'success': True, 'next_cursor': None, 'movies': Raw(
+                '[' + ','.join([encode_movie(row, links[row.id]) for row in movies]) + ']')})
+        return run
+
+    paths = {'jsonify': jsonify_path}
+    paths.update((name, compiled_path(provider)) for name, provider in providers.items())
+    results = {}
+    with app.app_context():
+        for name, run in paths.items():
+            best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+            results[name] = {
+                'ms': round(best * 1000, 2),
+                'rows_per_second': int(2 * args.rows / best),
+            }
+    baseline = results['jsonify']['ms']
+    for result in results.values():
+        result['speedup'] = round(baseline / result['ms'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
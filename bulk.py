@@ -0,0 +1,320 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, func, select
+
+import graph
+import search
+from models import db, Actor, Movie, CatalogStats, Tombstone, actor_movie
+
+INSERT_CHUNK_SIZE = 500
+
+
+class BatchError(Exception):
+    def __init__(self, errors, status_code=400):
+        self.errors = errors
+        self.status_code = status_code
+
+
+def validate_actor(item, partial=False):
+    values = {}
+    for field in ('name', 'gender'):
+        value = item.get(field)
+        if value is not None:
+            if not isinstance(value, str) or not value:
+                return None, f'"{field}" must be a non-empty string.'
+            values[field] = value
+    age = item.get('age')
+    if age is not None:
+        if not isinstance(age, int) or isinstance(age, bool) or age <= 0:
+            return None, '"age" must be a positive integer.'
+        values['age'] = age
+    if not partial and len(values) < 3:
+        return None, '"name", "age" and "gender" are required.'
+    if partial and not values:
+        return None, 'Nothing to update.'
+    return values, None
+
+
+def validate_movie(item, partial=False):
+    values = {}
+    title = item.get('title')
+    if title is not None:
+        if not isinstance(title, str) or not title:
+            return None, '"title" must be a non-empty string.'
+        values['title'] = title
+    release_date = item.get('release_date')
+    if release_date is not None:
+        try:
+            values['release_date'] = datetime.fromisoformat(release_date)
+        except (TypeError, ValueError):
+            return None, "Invalid date format. Use ISO 8601 format e.g., '2023-09-28T14:30:00"
+    if not partial and len(values) < 2:
+        return None, '"title" and "release_date" are required.'
+    if partial and not values:
+        return None, 'Nothing to update.'
+    return values, None
+
+
+def validate_batch(items, validator, max_size, partial=False):
+    """Validate every item of a batch before anything is written.
+
+    Returns the cleaned values in input order; for updates each value
+    dict also carries the item ``id``. Raises BatchError listing every
+    invalid item.
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchError([{'index': None, 'message': 'Expected a non-empty list.'}])
+    if len(items) > max_size:
+        raise BatchError([{'index': None,
+                           'message': f'A batch can contain at most {max_size} items.'}])
+    cleaned = []
+    errors = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'message': 'Expected an object.'})
+            continue
+        values, error = validator(item, partial)
+        if partial and error is None:
+            item_id = item.get('id')
+            if not isinstance(item_id, int) or isinstance(item_id, bool):
+                error = '"id" must be an integer.'
+            elif item_id in seen_ids:
+                error = f'Duplicate id {item_id}.'
+            else:
+                seen_ids.add(item_id)
+                values['id'] = item_id
+        if error:
+            errors.append({'index': index, 'message': error})
+        else:
+            cleaned.append(values)
+    if errors:
+        raise BatchError(errors)
+    return cleaned
+
+
+def validate_ids(ids, max_size):
+    if not isinstance(ids, list) or not ids:
+        raise BatchError([{'index': None, 'message': 'Expected a non-empty list of ids.'}])
+    if len(ids) > max_size:
+        raise BatchError([{'index': None,
+                           'message': f'A batch can contain at most {max_size} items.'}])
+    errors = [{'index': index, 'message': '"id" must be an integer.'}
+              for index, item_id in enumerate(ids)
+              if not isinstance(item_id, int) or isinstance(item_id, bool)]
+    if errors:
+        raise BatchError(errors)
+    return list(dict.fromkeys(ids))
+
+
+def require_existing(model, ids):
+    found = {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids))}
+    missing = [{'index': index, 'message': f'Resource {item_id} not found.'}
+               for index, item_id in enumerate(ids) if item_id not in found]
+    if missing:
+        raise BatchError(missing, 404)
+
+
+def bulk_insert(model, rows):
+    """Insert ``rows`` with multi-row INSERT statements and return the new ids in order."""
+    table = model.__table__
+    ids = []
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        statement = table.insert().values(chunk)
+        if db.engine.dialect.full_returning:
+            result = db.session.execute(statement.returning(table.c.id))
+            ids.extend(row[0] for row in result)
+        elif db.engine.dialect.name == 'sqlite':
+            # SQLite gives every row of a multi-row insert max(rowid) + 1,
+            # so the new ids are the contiguous range ending at lastrowid.
+            last_id = db.session.execute(statement).lastrowid
+            ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+        else:
+            objects = [model(**row) for row in chunk]
+            db.session.add_all(objects)
+            db.session.flush()
+            ids.extend(obj.id for obj in objects)
+    search.text_changed(model)
+    adjust_stats(**{model.__tablename__ + 's': len(ids)})
+    return ids
+
+
+def bulk_update(model, rows):
+    """Update ``rows`` (value dicts carrying an ``id``) with one executemany per column set."""
+    table = model.__table__
+    groups = {}
+    for row in rows:
+        columns = tuple(sorted(column for column in row if column != 'id'))
+        params = {column: row[column] for column in columns}
+        params['_id'] = row['id']
+        groups.setdefault(columns, []).append(params)
+    for columns, params in groups.items():
+        statement = table.update() \
+            .where(table.c.id == bindparam('_id')) \
+            .values({**{column: bindparam(column) for column in columns},
+                     'version': table.c.version + 1})
+        db.session.execute(statement, params)
+        if search.SEARCH_COLUMNS[model].key in columns:
+            search.text_changed(model)
+
+
+def adjust_counts(column, deltas):
+    """Add ``deltas`` (id -> change) to the count ``column``, in id order."""
+    params = [{'_id': row_id, '_delta': delta}
+              for row_id, delta in sorted(deltas.items()) if delta]
+    if params:
+        table = column.table
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('_id'))
+            .values({column.name: column + bindparam('_delta'),
+                     'version': table.c.version + 1}),
+            params)
+
+
+def adjust_stats(actors=0, movies=0, links=0):
+    """Add to the catalog totals, rebuilding the row if it is missing."""
+    table = CatalogStats.__table__
+    # The rebuild counts the rows, so pending ORM inserts must be visible.
+    db.session.flush()
+    result = db.session.execute(table.update().where(table.c.id == 1).values(
+        actors=table.c.actors + actors,
+        movies=table.c.movies + movies,
+        links=table.c.links + links))
+    if result.rowcount == 0:
+        rebuild_stats()
+
+
+def rebuild_stats():
+    table = CatalogStats.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().values(
+        id=1,
+        actors=select(func.count()).select_from(Actor.__table__).scalar_subquery(),
+        movies=select(func.count()).select_from(Movie.__table__).scalar_subquery(),
+        links=select(func.count()).select_from(actor_movie).scalar_subquery()))
+
+
+def backfill_counts():
+    """Recompute every stored count from the link table."""
+    for column, key_column in ((Actor.__table__.c.movie_count, actor_movie.c.actor_id),
+                               (Movie.__table__.c.actor_count, actor_movie.c.movie_id)):
+        count = select(func.count()).where(key_column == column.table.c.id).scalar_subquery()
+        db.session.execute(column.table.update().where(column != count)
+                           .values({column.name: count, 'version': column.table.c.version + 1}))
+    rebuild_stats()
+
+
+def claim_version(model, row_id, version):
+    """Bump the version of row ``row_id`` if it is still ``version``.
+
+    Returns False if another write got there first. On PostgreSQL the row
+    stays locked against other writers until the transaction ends.
+    """
+    table = model.__table__
+    result = db.session.execute(
+        table.update().where(table.c.id == row_id, table.c.version == version)
+        .values(version=table.c.version + 1))
+    return result.rowcount == 1
+
+
+def _delete_links(condition, count_actors=True, count_movies=True):
+    """Delete the links matching ``condition`` and decrement the counts they held.
+
+    Returns the removed ``(actor_id, movie_id)`` pairs.
+    """
+    statement = actor_movie.delete().where(condition)
+    if db.engine.dialect.full_returning:
+        removed = db.session.execute(
+            statement.returning(actor_movie.c.actor_id, actor_movie.c.movie_id)).all()
+    else:
+        removed = db.session.execute(
+            select(actor_movie.c.actor_id, actor_movie.c.movie_id).where(condition)).all()
+        db.session.execute(statement)
+    if count_movies:
+        adjust_counts(Movie.__table__.c.actor_count, _decrements(row[1] for row in removed))
+    if count_actors:
+        adjust_counts(Actor.__table__.c.movie_count, _decrements(row[0] for row in removed))
+    adjust_stats(links=-len(removed))
+    add_tombstones('link', [{'actor_id': actor_id, 'movie_id': movie_id}
+                            for actor_id, movie_id in removed])
+    graph.links_removed(removed)
+    return removed
+
+
+def _decrements(ids):
+    deltas = Counter()
+    for row_id in ids:
+        deltas[row_id] -= 1
+    return deltas
+
+
+def delete_links(actor_ids=None, movie_ids=None):
+    """Delete the links of ``actor_ids`` and/or ``movie_ids`` and return them."""
+    conditions = []
+    if actor_ids is not None:
+        conditions.append(actor_movie.c.actor_id.in_(actor_ids))
+    if movie_ids is not None:
+        conditions.append(actor_movie.c.movie_id.in_(movie_ids))
+    # Counts on the side being deleted are about to go with their rows.
+    return _delete_links(and_(*conditions), count_actors=actor_ids is None,
+                         count_movies=movie_ids is None)
+
+
+def bulk_delete(model, ids):
+    """Delete the rows with ``ids`` and their links.
+
+    Returns the ids on the other side of the removed links.
+    """
+    if model.__tablename__ == 'actor':
+        linked = {movie_id for _, movie_id in delete_links(actor_ids=ids)}
+    else:
+        linked = {actor_id for actor_id, _ in delete_links(movie_ids=ids)}
+    table = model.__table__
+    statement = table.delete().where(table.c.id.in_(ids))
+    if db.engine.dialect.full_returning:
+        deleted = [row[0] for row in db.session.execute(statement.returning(table.c.id))]
+    else:
+        deleted = sorted(existing_ids(model, ids))
+        db.session.execute(statement)
+    search.text_changed(model)
+    kind = model.__tablename__
+    add_tombstones(kind, [{f'{kind}_id': row_id} for row_id in deleted])
+    adjust_stats(**{kind + 's': -len(deleted)})
+    return linked
+
+
+def add_tombstones(kind, rows):
+    """Record deleted ``rows`` (their ``actor_id``/``movie_id``) for the change feed."""
+    if rows:
+        db.session.execute(Tombstone.__table__.insert(), [{'kind': kind, **row} for row in rows])
+
+
+def existing_ids(model, ids):
+    if not ids:
+        return set()
+    return {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids))}
+
+
+def linked_actor_ids(movie_id):
+    rows = db.session.query(actor_movie.c.actor_id).filter(actor_movie.c.movie_id == movie_id)
+    return {row[0] for row in rows}
+
+
+def add_links(movie_id, actor_ids):
+    if actor_ids:
+        db.session.execute(actor_movie.insert(), [
+            {'actor_id': actor_id, 'movie_id': movie_id} for actor_id in sorted(actor_ids)
+        ])
+        adjust_counts(Movie.__table__.c.actor_count, {movie_id: len(actor_ids)})
+        adjust_counts(Actor.__table__.c.movie_count, dict.fromkeys(actor_ids, 1))
+        adjust_stats(links=len(actor_ids))
+        graph.links_added(movie_id, actor_ids)
+
+
+def remove_links(movie_id, actor_ids):
+    if actor_ids:
+        _delete_links((actor_movie.c.movie_id == movie_id)
+                      & actor_movie.c.actor_id.in_(actor_ids))
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial, wraps
+from urllib.parse import urlencode
+
+from flask import current_app, g, request, make_response
+
+from metrics import Counter
+from singleflight import SingleFlight
+
+COALESCED_REQUESTS = Counter(
+    'http_coalesced_requests_total',
+    'Cache misses answered with the response of a concurrent identical request.', ['route'])
+
+
+class LRUBackend:
+    """In-process LRU store for cached responses.
+
+    Tag generations live in a separate dict so that evicting entries can
+    never roll a generation back.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generation(self, tag):
+        return self._generations.get(tag, 0)
+
+    def bump(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class RedisBackend:
+    """Shared store backed by a Redis-compatible client.
+
+    Only ``get``, ``set(name, value, ex=...)`` and ``incr`` are used, so
+    any object with those methods can stand in for the client.
+    """
+
+    def __init__(self, client, prefix='casting:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        etag, mimetype, body = raw.split(b'\n', 2)
+        return etag.decode('ascii'), mimetype.decode('ascii'), body
+
+    def set(self, key, value, ttl):
+        etag, mimetype, body = value
+        raw = etag.encode('ascii') + b'\n' + mimetype.encode('ascii') + b'\n' + body
+        self.client.set(self.prefix + key, raw, ex=ttl)
+
+    def generation(self, tag):
+        value = self.client.get(self.prefix + 'gen:' + tag)
+        return int(value) if value is not None else 0
+
+    def bump(self, tag):
+        self.client.incr(self.prefix + 'gen:' + tag)
+
+
+def make_backend(app):
+    name = app.config['CACHE_BACKEND']
+    if name == 'redis':
+        import redis
+        return RedisBackend(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+    if name == 'memory':
+        return LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+    return None
+
+
+class ResponseCache:
+    """Cache for GET handlers with strong ETags and tag based invalidation.
+
+    Entries are keyed by permission scope, path, query string and the
+    current generation of every tag the handler declares. Writes bump the
+    generations of the tags they affect, which orphans exactly the stale
+    entries.
+    """
+
+    def __init__(self):
+        self._flights = SingleFlight()
+
+    def init_app(self, app, backend=None):
+        app.config.setdefault('CACHE_BACKEND', os.getenv('CACHE_BACKEND', 'memory'))
+        app.config.setdefault('CACHE_REDIS_URL', os.getenv('CACHE_REDIS_URL'))
+        app.config.setdefault('CACHE_TTL', int(os.getenv('CACHE_TTL', '300')))
+        app.config.setdefault('CACHE_MAX_ENTRIES', int(os.getenv('CACHE_MAX_ENTRIES', '1024')))
+        app.extensions['response_cache'] = backend or make_backend(app)
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('response_cache')
+
+    def invalidate(self, *tags):
+        # Without a backend the flight keys carry no generations, so later
+        # requests must not join a flight that started before this write.
+        self._flights.forget()
+        backend = self.backend
+        if backend is None:
+            return
+        for tag in set(tags):
+            backend.bump(tag)
+
+    def _key(self, backend, scope, tags):
+        query = urlencode(sorted(request.args.items(multi=True)))
+        generations = ','.join(f'{tag}={backend.generation(tag)}' for tag in tags) \
+            if backend is not None else ''
+        raw = f'{scope}|{request.path}|{query}|{generations}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _respond(self, etag, mimetype, body):
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b'')
+        return response
+
+    def _fill(self, backend, key, f, args, kwargs):
+        """Run the handler and store a 200 response.
+
+        Returns the response and what concurrent identical requests are
+        answered with: ``(status, etag, mimetype, body)``, or None for a
+        streamed response.
+        """
+        response = make_response(f(*args, **kwargs))
+        if response.is_streamed:
+            return response, None
+        body = response.get_data()
+        if response.status_code != 200:
+            return response, (response.status_code, None, response.mimetype, body)
+        etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+        if backend is not None:
+            ttl = current_app.config['CACHE_TTL']
+            if g.get('db_replica') is not None:
+                ttl = min(ttl, max(1, int(current_app.config['REPLICA_MAX_LAG'])))
+            backend.set(key, (etag, response.mimetype, body), ttl)
+        return self._respond(etag, response.mimetype, body), (200, etag, response.mimetype, body)
+
+    def cached(self, scope, tags):
+        """Cache the decorated GET handler.
+
+        ``scope`` is the permission guarding the route and ``tags`` is
+        called with the view arguments and returns the invalidation tags
+        of the response. Must be applied below ``requires_auth``.
+
+        Identical requests that miss the cache at the same time run the
+        handler once in this process and share its response.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                backend = self.backend
+                key = self._key(backend, scope, tags(**kwargs))
+                fill = partial(self._fill, backend, key, f, args, kwargs)
+                # Requests pinned to the primary by replicas.py skip entries
+                # and flights that a lagging replica may serve after their write.
+                if g.get('db_pinned'):
+                    return fill()[0]
+                entry = backend.get(key) if backend is not None else None
+                if entry is not None:
+                    return self._respond(*entry)
+                (response, result), shared = self._flights.do(key, fill)
+                if not shared:
+                    return response
+                if result is None:
+                    return fill()[0]
+                COALESCED_REQUESTS.inc(route=request.url_rule.rule)
+                status, etag, mimetype, body = result
+                if etag is None:
+                    return current_app.response_class(body, status=status, mimetype=mimetype)
+                return self._respond(etag, mimetype, body)
+
+            return wrapper
+
+        return decorator
+
+
+response_cache = ResponseCache()
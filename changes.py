@@ -0,0 +1,205 @@
+"""Change feed for incremental sync: ``GET /changes?since=<cursor>``.
+
+Actors, movies and links are listed by ``updated_at`` and deletes by
+their tombstone's ``deleted_at``, in one order: time, then source, then
+key. A page is a single UNION ALL of one keyset range scan per source,
+each over its ``(updated_at, key)`` index and limited to the page size,
+so a poll with nothing new costs one indexed query. Each response
+carries the ``next_cursor`` to poll with; a client syncing from scratch
+omits ``since``.
+
+Only changes at least ``CHANGES_SETTLE_SECONDS`` old are listed, so that
+a write whose transaction commits after a later one's, or that was
+stamped by a worker with a slightly slow clock, is not passed over by a
+cursor that already moved beyond its timestamp. Once a client has read
+everything up to that horizon, its cursor moves up to it.
+
+A row changed several times between polls is listed once, with its
+current state. ``python manage.py purge_tombstones`` deletes tombstones
+older than ``CHANGES_RETENTION_DAYS``; a client whose cursor falls
+before the last purge gets a ``410`` and has to sync again from scratch.
+"""
+import os
+from datetime import datetime, timedelta
+
+from flask import abort, current_app, request
+from sqlalchemy import delete, insert, literal, select, tuple_, union_all
+
+from models import db, Actor, Movie, Tombstone, actor_movie
+from pagination import decode_cursor, encode_cursor, get_limit
+from read_models import fetch_records
+from serializers import entity_dicts
+
+SOURCES = ('actor', 'movie', 'link', 'tombstone')
+END = len(SOURCES)
+PURGE = 'purge'
+
+
+def _branches():
+    """The ``(time column, key columns, filter)`` of every source, in source order."""
+    actor, movie, tombstone = Actor.__table__, Movie.__table__, Tombstone.__table__
+    return [
+        (actor.c.updated_at, [actor.c.id], None),
+        (movie.c.updated_at, [movie.c.id], None),
+        (actor_movie.c.updated_at, [actor_movie.c.actor_id, actor_movie.c.movie_id], None),
+        (tombstone.c.deleted_at, [tombstone.c.id], tombstone.c.kind != PURGE),
+    ]
+
+
+def _after(source, ts_column, key_columns, cursor):
+    """The rows of ``source`` that come after ``cursor`` in feed order."""
+    if source < cursor['source']:
+        return ts_column > cursor['ts']
+    if source > cursor['source']:
+        return ts_column >= cursor['ts']
+    # Typed binds, so that SQLite compares timestamps in the stored format.
+    bound = [literal(cursor['ts'], ts_column.type)]
+    bound.extend(literal(key, column.type) for key, column in zip(cursor['key'], key_columns))
+    return tuple_(ts_column, *key_columns) > tuple_(*bound)
+
+
+def feed_query(cursor, horizon, limit):
+    """The first ``limit`` changes after ``cursor`` and up to ``horizon``."""
+    parts = []
+    for source, (ts_column, key_columns, condition) in enumerate(_branches()):
+        keys = key_columns + [literal(0)] * (2 - len(key_columns))
+        query = select(ts_column.label('ts'), literal(source).label('source'),
+                       keys[0].label('key1'), keys[1].label('key2')) \
+            .where(ts_column <= horizon)
+        if cursor is not None:
+            query = query.where(_after(source, ts_column, key_columns, cursor))
+        if condition is not None:
+            query = query.where(condition)
+        query = query.order_by(ts_column, *key_columns).limit(limit)
+        parts.append(select(query.subquery()))
+    feed = union_all(*parts).subquery()
+    return select(feed).order_by(feed.c.ts, feed.c.source, feed.c.key1, feed.c.key2) \
+        .limit(limit)
+
+
+def _key_length(source):
+    if source == END:
+        return 0
+    return len(_branches()[source][1])
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def decode_since(since):
+    values = decode_cursor(since, 'source')
+    source, key = values['source'], values.get('key')
+    if source > END or not isinstance(key, list) or len(key) != _key_length(source) or any(
+            not isinstance(item, int) or isinstance(item, bool) for item in key):
+        abort(400)
+    return {'ts': _parse_time(values.get('ts')), 'source': source, 'key': key,
+            'safe': _parse_time(values.get('safe'))}
+
+
+def encode_since(ts, source, key, safe):
+    return encode_cursor({'ts': ts.isoformat(), 'source': source, 'key': key,
+                          'safe': safe.isoformat()})
+
+
+def purged_since(safe, now):
+    """Whether a purge removed tombstones a client that is up to ``safe`` has not read.
+
+    Only cursors older than the retention period look for the purge marker.
+    """
+    if safe >= now - timedelta(days=current_app.config['CHANGES_RETENTION_DAYS']):
+        return False
+    table = Tombstone.__table__
+    marker = db.session.execute(select(table.c.id).where(
+        table.c.kind == PURGE, table.c.deleted_at > safe).limit(1)).first()
+    return marker is not None
+
+
+def purge_tombstones(now=None):
+    """Delete the tombstones older than ``CHANGES_RETENTION_DAYS`` and mark the cutoff."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=current_app.config['CHANGES_RETENTION_DAYS'])
+    table = Tombstone.__table__
+    result = db.session.execute(delete(table).where(table.c.deleted_at < cutoff))
+    db.session.execute(insert(table).values(kind=PURGE, deleted_at=cutoff))
+    return result.rowcount
+
+
+def _entities(model, rows, source):
+    ids = [row.key1 for row in rows if row.source == source]
+    if not ids:
+        return {}
+    return {item['id']: item for item in entity_dicts(model, fetch_records(model, ids))}
+
+
+def _tombstones(rows):
+    ids = [row.key1 for row in rows if row.source == SOURCES.index('tombstone')]
+    if not ids:
+        return {}
+    table = Tombstone.__table__
+    return {row.id: row for row in db.session.execute(select(table).where(table.c.id.in_(ids)))}
+
+
+def _change(row, actors, movies, tombstones):
+    source = SOURCES[row.source]
+    if source == 'link':
+        return {"type": "link", "op": "upsert", "changed_at": row.ts,
+                "actor_id": row.key1, "movie_id": row.key2}
+    if source == 'tombstone':
+        tombstone = tombstones[row.key1]
+        change = {"type": tombstone.kind, "op": "delete", "changed_at": row.ts}
+        if tombstone.kind == 'link':
+            change.update(actor_id=tombstone.actor_id, movie_id=tombstone.movie_id)
+        else:
+            change['id'] = tombstone.actor_id if tombstone.kind == 'actor' else tombstone.movie_id
+        return change
+    entity = (actors if source == 'actor' else movies).get(row.key1)
+    if entity is None:
+        # Deleted since the feed query ran; its tombstone comes later.
+        return None
+    return {"type": source, "op": "upsert", "changed_at": row.ts, "id": row.key1,
+            source: entity}
+
+
+def changes_page():
+    """Return the changes after the ``since`` cursor, the next cursor and whether more are ready."""
+    since = request.args.get('since')
+    cursor = decode_since(since) if since else None
+    now = datetime.utcnow()
+    if cursor is not None and purged_since(cursor['safe'], now):
+        abort(410)
+    horizon = now - timedelta(seconds=current_app.config['CHANGES_SETTLE_SECONDS'])
+    limit = get_limit()
+    rows = db.session.execute(feed_query(cursor, horizon, limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if has_more:
+        last = rows[-1]
+        position = (last.ts, last.source, [last.key1, last.key2][:_key_length(last.source)])
+    elif cursor is not None and cursor['ts'] >= horizon:
+        position = (cursor['ts'], cursor['source'], cursor['key'])
+    else:
+        position = (horizon, END, [])
+    # A client syncing from scratch never saw rows deleted before it started.
+    safe = max(cursor['safe'] if cursor is not None else horizon, position[0])
+    next_cursor = encode_since(*position, safe)
+
+    changes = []
+    if rows:
+        actors = _entities(Actor, rows, SOURCES.index('actor'))
+        movies = _entities(Movie, rows, SOURCES.index('movie'))
+        tombstones = _tombstones(rows)
+        changes = [change for change in (_change(row, actors, movies, tombstones)
+                                         for row in rows) if change is not None]
+    return changes, next_cursor, has_more
+
+
+def init_app(app):
+    app.config.setdefault('CHANGES_SETTLE_SECONDS',
+                          float(os.getenv('CHANGES_SETTLE_SECONDS', '5')))
+    app.config.setdefault('CHANGES_RETENTION_DAYS',
+                          int(os.getenv('CHANGES_RETENTION_DAYS', '30')))
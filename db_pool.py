@@ -0,0 +1,96 @@
+import os
+import time
+import weakref
+from functools import lru_cache
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+from metrics import Counter, Gauge, Histogram
+
+_pools = weakref.WeakValueDictionary()
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled connection.', ['pool'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Connection checkouts that timed out.', ['pool'])
+POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool.',
+    lambda: [({'pool': name}, pool.checkedout()) for name, pool in list(_pools.items())],
+    ['pool'])
+POOL_OVERFLOW = Gauge(
+    'db_pool_overflow', 'Connections open beyond pool_size.',
+    lambda: [({'pool': name}, max(pool.overflow(), 0)) for name, pool in list(_pools.items())],
+    ['pool'])
+POOL_SIZE = Gauge(
+    'db_pool_size', 'Configured pool size.',
+    lambda: [({'pool': name}, pool.size()) for name, pool in list(_pools.items())],
+    ['pool'])
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool reporting checkout latency, usage and timeouts to metrics."""
+
+    metrics_name = 'primary'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools[self.metrics_name] = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(pool=self.metrics_name)
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started, pool=self.metrics_name)
+
+
+@lru_cache(maxsize=None)
+def pool_class(name):
+    return type(f'InstrumentedQueuePool_{name}', (InstrumentedQueuePool,), {'metrics_name': name})
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(database_uri, name='primary'):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for ``database_uri`` from the environment.
+
+    With ``DB_PGBOUNCER`` set, pooling is left to PgBouncer (NullPool) and
+    the statement timeout is applied per transaction, because PgBouncer
+    rejects the ``options`` startup parameter.
+    """
+    if not database_uri or database_uri.startswith('sqlite'):
+        return {}
+
+    options = {'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true')}
+    if _env_bool('DB_PGBOUNCER', 'false'):
+        options['poolclass'] = NullPool
+    else:
+        options.update({
+            'poolclass': pool_class(name),
+            'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+            'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        })
+
+    if database_uri.startswith('postgresql'):
+        options['executemany_mode'] = 'values_plus_batch'
+        timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+        if timeout and not _env_bool('DB_PGBOUNCER', 'false'):
+            options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+def statement_timeout_per_transaction():
+    """Return the statement timeout to SET LOCAL on each transaction, if any."""
+    if _env_bool('DB_PGBOUNCER', 'false'):
+        timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+        return timeout or None
+    return None
@@ -0,0 +1,46 @@
+import zlib
+
+from flask import Response, current_app, json, request, stream_with_context
+
+
+def _batches(query, batch_size):
+    batch = []
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def ndjson_response(query, serialize):
+    """Stream ``query`` as newline-delimited JSON, one object per row.
+
+    Rows are read from a server-side cursor in batches of
+    ``EXPORT_BATCH_SIZE`` and ``serialize`` is called once per batch, so
+    memory use does not depend on the table size. The body is gzipped
+    when the client accepts it.
+    """
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+
+    def generate():
+        for batch in _batches(query, batch_size):
+            lines = [json.dumps(item) for item in serialize(batch)]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+    chunks = generate()
+    headers = {'X-Content-Type-Options': 'nosniff'}
+    if 'gzip' in request.accept_encodings:
+        chunks = _gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson',
+                    headers=headers)
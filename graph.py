@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, actor_movie
+
+GRAPH_TTL = float(os.getenv('GRAPH_TTL', '300'))
+MAX_PATH_DEPTH = int(os.getenv('GRAPH_MAX_PATH_DEPTH', '6'))
+
+
+class CostarGraph:
+    """Actor-movie adjacency lists held as ``array('i')`` per node.
+
+    An edge is stored twice, once under its actor and once under its
+    movie, at 4 bytes per entry. Once built, a list is never changed in
+    place: ``apply`` swaps in a new one, so the searches can run without
+    the lock while commits apply link changes.
+    """
+
+    def __init__(self, edges=()):
+        self.movies_of = {}
+        self.actors_of = {}
+        for actor_id, movie_id in edges:
+            self._append(actor_id, movie_id)
+
+    @property
+    def edges(self):
+        return sum(len(movie_ids) for movie_ids in list(self.movies_of.values()))
+
+    def _append(self, actor_id, movie_id):
+        movie_ids = self.movies_of.get(actor_id)
+        if movie_ids is None:
+            movie_ids = self.movies_of[actor_id] = array('i')
+        movie_ids.append(movie_id)
+        actor_ids = self.actors_of.get(movie_id)
+        if actor_ids is None:
+            actor_ids = self.actors_of[movie_id] = array('i')
+        actor_ids.append(actor_id)
+
+    def apply(self, added, pairs):
+        """Add (or remove) the ``(actor_id, movie_id)`` links in ``pairs``.
+
+        Each node touched gets one new list, whatever the number of its
+        pairs, so a batch costs one copy per node rather than per link.
+        """
+        for adjacency, side in ((self.movies_of, 0), (self.actors_of, 1)):
+            changed = {}
+            for pair in pairs:
+                changed.setdefault(pair[side], []).append(pair[1 - side])
+            for key, values in changed.items():
+                current = adjacency.get(key, ())
+                if added:
+                    present = set(current)
+                    new = [value for value in dict.fromkeys(values) if value not in present]
+                    if new:
+                        updated = array('i', current)
+                        updated.extend(new)
+                        adjacency[key] = updated
+                else:
+                    gone = set(values)
+                    kept = array('i', (value for value in current if value not in gone))
+                    if not kept:
+                        adjacency.pop(key, None)
+                    elif len(kept) < len(current):
+                        adjacency[key] = kept
+
+    def add(self, actor_id, movie_id):
+        self.apply(True, [(actor_id, movie_id)])
+
+    def remove(self, actor_id, movie_id):
+        self.apply(False, [(actor_id, movie_id)])
+
+    def costars(self, actor_id):
+        """Return ``(actor_id, shared movies)`` pairs, most shared movies first."""
+        shared = Counter()
+        for movie_id in self.movies_of.get(actor_id, ()):
+            shared.update(self.actors_of.get(movie_id, ()))
+        shared.pop(actor_id, None)
+        return sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+
+    def _expand(self, frontier, seen, other):
+        """Advance one side of the search by a movie hop.
+
+        Returns the actor where the two sides meet, if any.
+        """
+        next_frontier = []
+        for actor_id in frontier:
+            for movie_id in self.movies_of.get(actor_id, ()):
+                for costar_id in self.actors_of.get(movie_id, ()):
+                    if costar_id not in seen:
+                        seen[costar_id] = (actor_id, movie_id)
+                        if costar_id in other:
+                            return costar_id, next_frontier
+                        next_frontier.append(costar_id)
+        return None, next_frontier
+
+    def path(self, source, target, max_depth=MAX_PATH_DEPTH):
+        """Find a shortest chain of costars from ``source`` to ``target``.
+
+        Runs a breadth-first search from both ends, always expanding the
+        smaller frontier, for at most ``max_depth`` movie hops. Returns the
+        actor ids and the movie ids joining each consecutive pair, or
+        ``None`` when the actors are further apart.
+        """
+        if source == target:
+            return [source], []
+        forward, backward = {source: None}, {target: None}
+        forward_frontier, backward_frontier = [source], [target]
+        for _ in range(max_depth):
+            if not forward_frontier or not backward_frontier:
+                return None
+            if len(forward_frontier) <= len(backward_frontier):
+                meet, forward_frontier = self._expand(forward_frontier, forward, backward)
+            else:
+                meet, backward_frontier = self._expand(backward_frontier, backward, forward)
+            if meet is not None:
+                return self._join(meet, forward, backward)
+        return None
+
+    @staticmethod
+    def _join(meet, forward, backward):
+        actor_ids, movie_ids = [meet], []
+        step = forward[meet]
+        while step is not None:
+            actor_ids.insert(0, step[0])
+            movie_ids.insert(0, step[1])
+            step = forward[step[0]]
+        step = backward[meet]
+        while step is not None:
+            actor_ids.append(step[0])
+            movie_ids.append(step[1])
+            step = backward[step[0]]
+        return actor_ids, movie_ids
+
+
+_graph = None
+_built_at = 0.0
+_building = None
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def build_graph():
+    """Read every link in one scan and build a fresh ``CostarGraph``."""
+    rows = db.session.execute(select(actor_movie.c.actor_id, actor_movie.c.movie_id))
+    return CostarGraph(rows)
+
+
+def _fresh():
+    return _graph is not None and time.monotonic() - _built_at < GRAPH_TTL
+
+
+def get_graph():
+    """Return the process-wide graph, rebuilt after ``GRAPH_TTL`` seconds.
+
+    Link changes committed in this process are applied as they commit;
+    the TTL bounds how long changes made by other processes go unseen.
+    """
+    global _graph, _built_at, _building
+    if _fresh():
+        return _graph
+    with _build_lock:
+        if _fresh():
+            return _graph
+        with _lock:
+            _building = []
+        try:
+            graph = build_graph()
+            with _lock:
+                # Changes committed while the scan ran may be missing from it.
+                for change in _building:
+                    graph.apply(*change)
+                _graph, _built_at = graph, time.monotonic()
+        finally:
+            with _lock:
+                _building = None
+    return _graph
+
+
+def clear():
+    global _graph
+    _graph = None
+
+
+def links_added(movie_id, actor_ids):
+    db.session.info.setdefault('graph_changes', []).append(
+        (True, [(actor_id, movie_id) for actor_id in actor_ids]))
+
+
+def links_removed(pairs):
+    db.session.info.setdefault('graph_changes', []).append((False, list(pairs)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_on_commit(session):
+    changes = session.info.pop('graph_changes', None)
+    if not changes:
+        return
+    with _lock:
+        for change in changes:
+            if _graph is not None:
+                _graph.apply(*change)
+            if _building is not None:
+                _building.append(change)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changes(session, previous_transaction):
+    session.info.pop('graph_changes', None)
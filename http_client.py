@@ -0,0 +1,199 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stop calling an upstream after ``failure_threshold`` consecutive failures.
+
+    Once open, calls fail fast for ``reset_timeout`` seconds. After that a
+    single trial call is let through; its outcome closes the breaker or
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release_trial(self):
+        """Let another trial through after one that ended without an outcome."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class HTTPClient:
+    """Keep-alive HTTP client with timeouts, retries and a circuit breaker.
+
+    Connection errors are retried for every method because the request
+    never reached the server. Timeouts and ``RETRY_STATUSES`` are only
+    retried for idempotent methods, so a one-time OAuth code is never
+    posted twice. Retries back off exponentially with full jitter.
+    """
+
+    def __init__(self, connect_timeout=2.0, read_timeout=5.0, retries=2, backoff=0.1,
+                 max_backoff=2.0, breaker=None, max_connections=20, transport=None):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.transport = transport
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(timeout=self.timeout, limits=self.limits,
+                                                transport=self.transport)
+        return self._client
+
+    def async_client(self, **kwargs):
+        """Build an ``httpx.AsyncClient`` with the same timeouts and limits."""
+        return httpx.AsyncClient(timeout=self.timeout, limits=self.limits, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(url)
+            recorded = False
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                recorded = True
+                self.breaker.record_failure()
+                if not self._retry(method, e, attempt):
+                    raise
+            else:
+                recorded = True
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                if not self._retry(method, response, attempt):
+                    return response
+                response.close()
+            finally:
+                if not recorded:
+                    # Any other error or a cancellation says nothing about
+                    # the upstream, but must not leave a trial held forever.
+                    self.breaker.release_trial()
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def request_async(self, client, method, url, **kwargs):
+        """Like ``request`` but on the given ``httpx.AsyncClient``."""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(url)
+            recorded = False
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                recorded = True
+                self.breaker.record_failure()
+                if not self._retry(method, e, attempt):
+                    raise
+            else:
+                recorded = True
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                if not self._retry(method, response, attempt):
+                    return response
+                await response.aclose()
+            finally:
+                if not recorded:
+                    # Any other error or a cancellation says nothing about
+                    # the upstream, but must not leave a trial held forever.
+                    self.breaker.release_trial()
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    def _retry(self, method, outcome, attempt):
+        if attempt >= self.retries:
+            return False
+        if isinstance(outcome, httpx.ConnectError) or isinstance(outcome, httpx.ConnectTimeout):
+            return True
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        if isinstance(outcome, httpx.TransportError):
+            return True
+        return outcome.status_code in RETRY_STATUSES
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+identity_client = HTTPClient(
+    connect_timeout=float(os.getenv('IDP_CONNECT_TIMEOUT', '2')),
+    read_timeout=float(os.getenv('IDP_READ_TIMEOUT', '5')),
+    retries=int(os.getenv('IDP_RETRIES', '2')),
+    breaker=CircuitBreaker(int(os.getenv('IDP_BREAKER_THRESHOLD', '5')),
+                           float(os.getenv('IDP_BREAKER_RESET', '30'))),
+)
@@ -0,0 +1,207 @@
+"""``Idempotency-Key`` support for the write endpoints.
+
+A client that retries a write sends the same ``Idempotency-Key`` header
+(at most 255 characters) with every attempt. The first request claims
+the key in the ``idempotency_key`` table and runs; its response, when
+successful, is stored and replayed to every retry for ``IDEMPOTENCY_TTL``
+seconds without running the handler again. Keys are scoped to the
+token's subject, and reusing one for a different method, path or body
+is a ``422``. Replays carry the stored ``Location`` and ``ETag`` headers
+as well as the status and body.
+
+A duplicate that arrives while the first request is still running waits
+up to ``IDEMPOTENCY_WAIT`` seconds for its response (woken directly in
+the same process, polling across workers) and gets a ``409`` if it is
+still running then. A claim that is still unfinished after
+``IDEMPOTENCY_LEASE`` seconds is taken to belong to a worker that died
+and is claimed again by the next retry. Error responses are not stored: they release the key
+so that the retry runs again. Expired keys are deleted at most once per
+``IDEMPOTENCY_PURGE_INTERVAL`` seconds.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import _request_ctx_stack, abort, current_app, make_response, request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from metrics import Counter
+from models import db, IdempotencyKey
+
+KEY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ('Location', 'ETag')
+
+IDEMPOTENT_REQUESTS = Counter(
+    'idempotent_requests_total',
+    'Requests sent with an Idempotency-Key, by how they were answered.', ['result'])
+
+_running = {}
+_running_lock = threading.Lock()
+_purged_at = 0.0
+
+
+def _digest(*parts):
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def _subject():
+    payload = getattr(_request_ctx_stack.top, 'current_user', None) or {}
+    return str(payload.get('sub', ''))
+
+
+def _purge_if_due(now):
+    global _purged_at
+    interval = current_app.config['IDEMPOTENCY_PURGE_INTERVAL']
+    if time.monotonic() - _purged_at < interval:
+        return
+    _purged_at = time.monotonic()
+    table = IdempotencyKey.__table__
+    cutoff = now - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+    db.session.execute(delete(table).where(table.c.created_at < cutoff))
+    db.session.commit()
+
+
+def _claim(key, fingerprint):
+    """Claim ``key`` for this request.
+
+    Returns ``(None, claimed_at)`` when the claim is ours, where
+    ``claimed_at`` identifies it to ``_finish``, or ``(row, None)`` with
+    the row of the request that holds the key.
+    """
+    table = IdempotencyKey.__table__
+    ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+    lease = timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE'])
+    while True:
+        now = datetime.utcnow()
+        _purge_if_due(now)
+        try:
+            db.session.execute(insert(table).values(key=key, fingerprint=fingerprint,
+                                                    created_at=now))
+            db.session.commit()
+            return None, now
+        except IntegrityError:
+            db.session.rollback()
+        row = db.session.execute(select(table).where(table.c.key == key)).first()
+        db.session.commit()
+        if row is None:
+            continue
+        if row.created_at >= now - (ttl if row.status_code is not None else lease):
+            return row, None
+        db.session.execute(delete(table).where(table.c.key == key,
+                                               table.c.created_at == row.created_at))
+        db.session.commit()
+
+
+def _finish(key, claimed_at, response):
+    """Store ``response`` for the claim made at ``claimed_at``, or release it.
+
+    A claim whose lease ran out may have been taken over by a retry; its
+    row is then left alone and nothing is stored.
+    """
+    table = IdempotencyKey.__table__
+    ours = (table.c.key == key) & (table.c.created_at == claimed_at)
+    db.session.rollback()
+    if response is not None:
+        db.session.execute(update(table).where(ours).values(
+            status_code=response.status_code, mimetype=response.mimetype,
+            body=response.get_data(),
+            headers=json.dumps({name: response.headers[name] for name in REPLAYED_HEADERS
+                                if name in response.headers})))
+    else:
+        db.session.execute(delete(table).where(ours))
+    db.session.commit()
+
+
+def _wait(key, deadline):
+    """Wait for the request running ``key`` to finish; False once past ``deadline``."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    with _running_lock:
+        finished = _running.get(key)
+    if finished is not None:
+        finished.wait(remaining)
+    else:
+        time.sleep(min(0.05, remaining))
+    return True
+
+
+def _replay(row):
+    response = current_app.response_class(row.body, status=row.status_code,
+                                          mimetype=row.mimetype)
+    response.headers.update(json.loads(row.headers or '{}'))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _run(key, claimed_at, f, args, kwargs):
+    finished = threading.Event()
+    with _running_lock:
+        _running[key] = finished
+    response = None
+    try:
+        response = make_response(f(*args, **kwargs))
+        return response
+    finally:
+        try:
+            stored = (response is not None and response.status_code < 400
+                      and not response.is_streamed)
+            _finish(key, claimed_at, response if stored else None)
+        finally:
+            with _running_lock:
+                if _running.get(key) is finished:
+                    del _running[key]
+            finished.set()
+
+
+def idempotent(f):
+    """Deduplicate retries of the decorated write handler by ``Idempotency-Key``.
+
+    Must be applied below ``requires_auth``.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        raw_key = request.headers.get(KEY_HEADER)
+        if raw_key is None:
+            return f(*args, **kwargs)
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            abort(400)
+        key = _digest(_subject(), raw_key)
+        fingerprint = _digest(request.method, request.full_path, request.get_data())
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+        waited = False
+        while True:
+            row, claimed_at = _claim(key, fingerprint)
+            if row is None:
+                IDEMPOTENT_REQUESTS.inc(result='executed')
+                return _run(key, claimed_at, f, args, kwargs)
+            if row.fingerprint != fingerprint:
+                IDEMPOTENT_REQUESTS.inc(result='mismatch')
+                abort(422)
+            if row.status_code is not None:
+                IDEMPOTENT_REQUESTS.inc(result='coalesced' if waited else 'replayed')
+                return _replay(row)
+            if not _wait(key, deadline):
+                IDEMPOTENT_REQUESTS.inc(result='conflict')
+                abort(409)
+            waited = True
+
+    return wrapper
+
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_TTL', int(os.getenv('IDEMPOTENCY_TTL', '86400')))
+    app.config.setdefault('IDEMPOTENCY_WAIT', float(os.getenv('IDEMPOTENCY_WAIT', '10')))
+    app.config.setdefault('IDEMPOTENCY_LEASE', float(os.getenv('IDEMPOTENCY_LEASE', '60')))
+    app.config.setdefault('IDEMPOTENCY_PURGE_INTERVAL',
+                          float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', '60')))
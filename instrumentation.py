@@ -0,0 +1,109 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import Histogram
+
+logger = logging.getLogger('casting.performance')
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests.',
+    ['route', 'method', 'status'])
+REQUEST_PHASE_SECONDS = Histogram(
+    'http_request_phase_seconds',
+    'Time spent per request in auth (jwks included), jwks, sql and serialize.',
+    ['route', 'phase'])
+REQUEST_QUERIES = Histogram(
+    'http_request_sql_statements', 'SQL statements run per request.', ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500))
+SQL_STATEMENT_SECONDS = Histogram(
+    'db_statement_duration_seconds', 'Time spent executing SQL statements.',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+def _add(phase, seconds):
+    timings = getattr(g, '_timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to phase ``name`` of the current request."""
+    if not has_request_context():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(name, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['statement_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('statement_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    SQL_STATEMENT_SECONDS.observe(elapsed)
+    if has_request_context() and getattr(g, '_timings', None) is not None:
+        g._timings['sql'] = g._timings.get('sql', 0.0) + elapsed
+        g._statements += 1
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning('slow query %.1fms: %s', elapsed * 1000, ' '.join(statement.split())[:500])
+
+
+def _start_request():
+    g._started = time.perf_counter()
+    g._timings = {}
+    g._statements = 0
+
+
+def _finish_request(response):
+    started = getattr(g, '_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, route=route, method=request.method,
+                            status=response.status_code)
+    REQUEST_QUERIES.observe(g._statements, route=route)
+    for name, seconds in g._timings.items():
+        REQUEST_PHASE_SECONDS.observe(seconds, route=route, phase=name)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning('slow request %.1fms: %s %s %s, %d statements, %s',
+                       elapsed * 1000, request.method, request.full_path.rstrip('?'),
+                       response.status_code, g._statements,
+                       ', '.join(f'{name} {seconds * 1000:.1f}ms'
+                                 for name, seconds in sorted(g._timings.items())))
+    return response
+
+
+def init_app(app):
+    """Time every request of ``app`` by route, status and phase.
+
+    Streamed responses are timed until the response is returned, not
+    until the body has been sent.
+    """
+    class TimedJSONEncoder(app.json_encoder):
+        def encode(self, o):
+            with phase('serialize'):
+                return super().encode(o)
+
+    app.json_encoder = TimedJSONEncoder
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
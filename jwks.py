@@ -0,0 +1,193 @@
+import json
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+
+DEFAULT_TTL = 600
+MIN_TTL = 30
+REFRESH_AHEAD = 60
+MIN_REFETCH_INTERVAL = 30
+FETCH_TIMEOUT = 5
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class JWKSFetchError(Exception):
+    pass
+
+
+def parse_max_age(cache_control):
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = _MAX_AGE_RE.search(directives)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+class JWKSKeyStore:
+    """Process-wide cache of the signing keys published at a JWKS url.
+
+    Keys are parsed once and indexed by ``kid``. The key set is refreshed
+    in the background shortly before it expires; an unknown ``kid``
+    triggers at most one refetch per ``min_refetch_interval``, and the
+    last good key set keeps being served while the endpoint is failing.
+    The url may be ``file://`` so the store can be pointed at a local
+    JWKS document. Remote key sets are fetched with ``client`` (an
+    ``http_client.HTTPClient``) when given, otherwise with urllib.
+    """
+
+    def __init__(self, url, algorithm='RS256', ttl=DEFAULT_TTL,
+                 min_ttl=MIN_TTL, refresh_ahead=REFRESH_AHEAD,
+                 min_refetch_interval=MIN_REFETCH_INTERVAL,
+                 timeout=FETCH_TIMEOUT, background_refresh=True, client=None):
+        self.url = url
+        self.client = client
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.background_refresh = background_refresh
+
+        self._keys = {}
+        self._expires_at = 0
+        self._last_attempt = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def get_key(self, kid):
+        now = time.time()
+        if not self._keys or now >= self._expires_at:
+            self.refresh(stale_ok=bool(self._keys))
+
+        key = self._keys.get(kid)
+        if key is None and time.time() - self._last_attempt >= self.min_refetch_interval:
+            self.refresh(stale_ok=True)
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self, stale_ok=True):
+        started = time.time()
+        with self._lock:
+            # Another thread refreshed while we were waiting for the lock.
+            if self._last_attempt >= started and self._keys:
+                return
+            self._last_attempt = time.time()
+            try:
+                keys, ttl = self._fetch()
+            except Exception as e:
+                self._schedule(self.min_refetch_interval)
+                if stale_ok and self._keys:
+                    return
+                raise JWKSFetchError(str(e)) from e
+            self._keys = keys
+            self._expires_at = time.time() + ttl
+            self._schedule(max(ttl - self.refresh_ahead, self.min_ttl))
+
+    def clear(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._keys = {}
+            self._expires_at = 0
+            self._last_attempt = 0
+
+    def load(self, jwks, ttl=None):
+        with self._lock:
+            self._keys = self._parse(jwks)
+            self._expires_at = time.time() + (ttl or self.ttl)
+
+    def _fetch(self):
+        if self.client is not None and not self.url.startswith('file://'):
+            response = self.client.get(self.url)
+            response.raise_for_status()
+            body = response.content
+            max_age = parse_max_age(response.headers.get('Cache-Control'))
+        else:
+            response = urlopen(self.url, timeout=self.timeout)
+            try:
+                body = response.read()
+                max_age = parse_max_age(response.headers.get('Cache-Control'))
+            finally:
+                response.close()
+        ttl = self.ttl if max_age is None else max(max_age, self.min_ttl)
+        return self._parse(json.loads(body)), ttl
+
+    def _parse(self, jwks):
+        keys = {}
+        for key in jwks.get('keys', []):
+            if key.get('kty') != 'RSA' or 'kid' not in key:
+                continue
+            if key.get('use', 'sig') != 'sig':
+                continue
+            keys[key['kid']] = jwk.construct({
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use', 'sig'),
+                'n': key['n'],
+                'e': key['e']
+            }, self.algorithm)
+        return keys
+
+    def _schedule(self, delay):
+        if not self.background_refresh:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(stale_ok=True)
+        except JWKSFetchError:
+            pass
+
+
+class LocalKeyPair:
+    """RSA key pair held in process, for verifying tokens without a network.
+
+    Exposes the same ``get_key(kid)`` as ``JWKSKeyStore`` and signs
+    tokens with the private half. The key is generated unless a PEM
+    private key is given.
+    """
+
+    def __init__(self, private_pem=None, kid='local', algorithm='RS256', key_size=2048):
+        if private_pem is None:
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+            private_pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                                    serialization.PrivateFormat.PKCS8,
+                                                    serialization.NoEncryption())
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_pem = private_pem
+        self.signing_key = jwk.construct(private_pem, algorithm)
+        self.public_key = self.signing_key.public_key()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, 'rb') as f:
+            return cls(f.read(), **kwargs)
+
+    def get_key(self, kid):
+        return self.public_key if kid == self.kid else None
+
+    def jwks(self):
+        key = self.public_key.to_dict()
+        key.update({'kid': self.kid, 'use': 'sig'})
+        return {'keys': [key]}
+
+    def clear(self):
+        pass
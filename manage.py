@@ -1,14 +1,37 @@
-from flask_script import Manager
+from flask_script import Command, Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import app
+from bulk import backfill_counts
+from changes import purge_tombstones
 from models import db
+from search import include_object
 
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, include_object=include_object)
 manager = Manager(app)
 
+
+class Backfill(Command):
+    """Recompute the stored movie and cast counts and the catalog totals."""
+
+    def run(self):
+        backfill_counts()
+        db.session.commit()
+
+
+class PurgeTombstones(Command):
+    """Delete the change feed tombstones older than CHANGES_RETENTION_DAYS."""
+
+    def run(self):
+        purged = purge_tombstones()
+        db.session.commit()
+        print(f'Purged {purged} tombstones.')
+
+
 manager.add_command('db', MigrateCommand)
+manager.add_command('backfill', Backfill())
+manager.add_command('purge_tombstones', PurgeTombstones())
 
 
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
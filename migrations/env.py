@@ -3,9 +3,11 @@ from __future__ import with_statement
 import logging
 from logging.config import fileConfig
 
+import sqlalchemy as sa
 from flask import current_app
 
 from alembic import context
+from alembic.script import ScriptDirectory
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -30,6 +32,25 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# Before migrations, the app made its tables with db.create_all(), which
+# gave the schema of the initial revision.
+BASELINE_REVISION = '4f2a9c1d7e3b'
+BASELINE_ACTOR_COLUMNS = {'id', 'name', 'age', 'gender'}
+
+
+def stamp_create_all_database(connection):
+    """Stamp a database created by db.create_all() with the initial revision,
+    so that upgrading it starts from there instead of creating the tables again."""
+    inspector = sa.inspect(connection)
+    tables = inspector.get_table_names()
+    if 'alembic_version' in tables or 'actor' not in tables:
+        return
+    columns = {column['name'] for column in inspector.get_columns('actor')}
+    if columns != BASELINE_ACTOR_COLUMNS:
+        return
+    logger.info('Stamping tables created by db.create_all() as %s.', BASELINE_REVISION)
+    context.get_context().stamp(ScriptDirectory.from_config(config), BASELINE_REVISION)
+
 
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
@@ -81,6 +102,8 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            if not getattr(config.cmd_opts, 'autogenerate', False):
+                stamp_create_all_database(connection)
             context.run_migrations()
 
 
@@ -0,0 +1,37 @@
+"""add search indexes
+
+Revision ID: 3c7d2e91b4a6
+Revises: 8b1e6d0f5a92
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7d2e91b4a6'
+down_revision = '8b1e6d0f5a92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Full-text and trigram indexes only exist on PostgreSQL; other
+    # databases are searched with the in-memory index in search.py.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute("CREATE INDEX ix_actor_name_fts ON actor USING gin (to_tsvector('simple', name))")
+    op.execute('CREATE INDEX ix_actor_name_trgm ON actor USING gin (name gin_trgm_ops)')
+    op.execute("CREATE INDEX ix_movie_title_fts ON movie USING gin (to_tsvector('simple', title))")
+    op.execute('CREATE INDEX ix_movie_title_trgm ON movie USING gin (title gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_movie_title_trgm', table_name='movie')
+    op.drop_index('ix_movie_title_fts', table_name='movie')
+    op.drop_index('ix_actor_name_trgm', table_name='actor')
+    op.drop_index('ix_actor_name_fts', table_name='actor')
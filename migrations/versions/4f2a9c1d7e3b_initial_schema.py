@@ -0,0 +1,45 @@
+"""initial schema
+
+Revision ID: 4f2a9c1d7e3b
+Revises: 
+Create Date: 2024-09-29 15:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c1d7e3b'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('actor',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('age', sa.Integer(), nullable=False),
+        sa.Column('gender', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('movie',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('release_date', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('actor_movie',
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['actor_id'], ['actor.id'], ),
+        sa.ForeignKeyConstraint(['movie_id'], ['movie.id'], ),
+        sa.PrimaryKeyConstraint('actor_id', 'movie_id')
+    )
+
+
+def downgrade():
+    op.drop_table('actor_movie')
+    op.drop_table('movie')
+    op.drop_table('actor')
@@ -0,0 +1,47 @@
+"""add link counts and catalog stats
+
+Revision ID: 6a4d1f8c2e57
+Revises: 3c7d2e91b4a6
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a4d1f8c2e57'
+down_revision = '3c7d2e91b4a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actor', sa.Column('movie_count', sa.Integer(), nullable=False,
+                                     server_default='0'))
+    op.add_column('movie', sa.Column('actor_count', sa.Integer(), nullable=False,
+                                     server_default='0'))
+    op.create_index('ix_actor_movie_count', 'actor', ['movie_count', 'id'])
+    op.create_index('ix_movie_actor_count', 'movie', ['actor_count', 'id'])
+    op.create_table('catalog_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('actors', sa.Integer(), nullable=False),
+    sa.Column('movies', sa.Integer(), nullable=False),
+    sa.Column('links', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('UPDATE actor SET movie_count = '
+               '(SELECT count(*) FROM actor_movie WHERE actor_movie.actor_id = actor.id)')
+    op.execute('UPDATE movie SET actor_count = '
+               '(SELECT count(*) FROM actor_movie WHERE actor_movie.movie_id = movie.id)')
+    op.execute('INSERT INTO catalog_stats (id, actors, movies, links) SELECT 1, '
+               '(SELECT count(*) FROM actor), (SELECT count(*) FROM movie), '
+               '(SELECT count(*) FROM actor_movie)')
+
+
+def downgrade():
+    op.drop_table('catalog_stats')
+    op.drop_index('ix_movie_actor_count', table_name='movie')
+    op.drop_index('ix_actor_movie_count', table_name='actor')
+    op.drop_column('movie', 'actor_count')
+    op.drop_column('actor', 'movie_count')
@@ -0,0 +1,33 @@
+"""add list filter indexes
+
+Revision ID: 8b1e6d0f5a92
+Revises: 4f2a9c1d7e3b
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e6d0f5a92'
+down_revision = '4f2a9c1d7e3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actor_age', 'actor', ['age'])
+    op.create_index('ix_actor_gender', 'actor', ['gender'])
+    op.create_index('ix_movie_release_date', 'movie', ['release_date'])
+    op.create_index('ix_movie_title', 'movie', ['title'],
+                    postgresql_ops={'title': 'text_pattern_ops'})
+    op.create_index('ix_actor_movie_movie_id', 'actor_movie', ['movie_id'])
+
+
+def downgrade():
+    op.drop_index('ix_actor_movie_movie_id', table_name='actor_movie')
+    op.drop_index('ix_movie_title', table_name='movie')
+    op.drop_index('ix_movie_release_date', table_name='movie')
+    op.drop_index('ix_actor_gender', table_name='actor')
+    op.drop_index('ix_actor_age', table_name='actor')
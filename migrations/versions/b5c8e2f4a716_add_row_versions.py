@@ -0,0 +1,28 @@
+"""add row versions
+
+Revision ID: b5c8e2f4a716
+Revises: 9d3b7a5e1c40
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c8e2f4a716'
+down_revision = '9d3b7a5e1c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actor', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+    op.add_column('movie', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+
+
+def downgrade():
+    op.drop_column('movie', 'version')
+    op.drop_column('actor', 'version')
@@ -0,0 +1,51 @@
+"""add change feed
+
+Revision ID: e7a1c4d9b203
+Revises: b5c8e2f4a716
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c4d9b203'
+down_revision = 'b5c8e2f4a716'
+branch_labels = None
+depends_on = None
+
+# Existing rows report the epoch, so the first sync lists them before any new change.
+EPOCH = '1970-01-01 00:00:00.000000'
+
+
+def upgrade():
+    for table in ('actor', 'movie', 'actor_movie'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                       server_default=EPOCH))
+    op.create_index('ix_actor_updated_at', 'actor', ['updated_at', 'id'], unique=False)
+    op.create_index('ix_movie_updated_at', 'movie', ['updated_at', 'id'], unique=False)
+    op.create_index('ix_actor_movie_updated_at', 'actor_movie',
+                    ['updated_at', 'actor_id', 'movie_id'], unique=False)
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=True),
+    sa.Column('movie_id', sa.Integer(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_deleted_at', 'tombstone', ['deleted_at', 'id'], unique=False)
+    op.create_index('ix_tombstone_kind_deleted_at', 'tombstone', ['kind', 'deleted_at'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tombstone_kind_deleted_at', table_name='tombstone')
+    op.drop_index('ix_tombstone_deleted_at', table_name='tombstone')
+    op.drop_table('tombstone')
+    op.drop_index('ix_actor_movie_updated_at', table_name='actor_movie')
+    op.drop_index('ix_movie_updated_at', table_name='movie')
+    op.drop_index('ix_actor_updated_at', table_name='actor')
+    for table in ('actor_movie', 'movie', 'actor'):
+        op.drop_column(table, 'updated_at')
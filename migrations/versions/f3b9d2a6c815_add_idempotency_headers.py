@@ -0,0 +1,24 @@
+"""add idempotency headers
+
+Revision ID: f3b9d2a6c815
+Revises: e7a1c4d9b203
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9d2a6c815'
+down_revision = 'e7a1c4d9b203'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('idempotency_key', sa.Column('headers', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('idempotency_key', 'headers')
@@ -1,43 +1,120 @@
 import os
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+from db_pool import engine_options, statement_timeout_per_transaction
 
 database_path = os.getenv('DATABASE_URL')
 if database_path.startswith("postgres://"):
     database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
 
-def setup_db(app, database_path=database_path):
+class RoutingSession(SignallingSession):
+    """Sends reads to the replica replicas.py chose for the request, if any.
+
+    Flushes and write statements go to the primary, and so does every
+    later read of the request, which then sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is not None:
+            if not self._flushing and not isinstance(clause, UpdateBase):
+                return replica
+            g.db_replica = None
+        return super().get_bind(mapper, clause)
+
+
+class CastingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        timeout = statement_timeout_per_transaction()
+        if timeout and engine.dialect.name == 'postgresql':
+            @event.listens_for(engine, 'begin')
+            def set_statement_timeout(conn):
+                conn.exec_driver_sql(f'SET LOCAL statement_timeout = {timeout}')
+        return engine
+
+
+db = CastingSQLAlchemy()
+
+def setup_db(app, database_path=database_path, schema_mode=None):
+    """Bind the app to the database.
+
+    ``schema_mode`` (or ``DB_SCHEMA_MODE``) controls DDL at startup:
+    ``migrate``, the default, leaves the schema to ``python manage.py db upgrade``
+    and runs no DDL; ``create`` creates missing tables, for tests and local runs.
+    """
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.drop_all()
-    db.create_all()
+    schema_mode = schema_mode or os.getenv('DB_SCHEMA_MODE', 'migrate')
+    if schema_mode == 'create':
+        db.create_all()
+    elif schema_mode != 'migrate':
+        raise ValueError(f'Unknown DB_SCHEMA_MODE {schema_mode!r}')
+
+
+# Rows that predate change tracking report the epoch. The fraction keeps
+# SQLite's text timestamps comparable with the ones SQLAlchemy writes.
+EPOCH = '1970-01-01 00:00:00.000000'
+
+
+def updated_at_column():
+    return db.Column('updated_at', db.DateTime, nullable=False, default=datetime.utcnow,
+                     onupdate=datetime.utcnow, server_default=EPOCH)
+
 
 actor_movie = db.Table('actor_movie',
     db.Column('actor_id', db.Integer, db.ForeignKey('actor.id'), primary_key=True),
-    db.Column('movie_id', db.Integer, db.ForeignKey('movie.id'), primary_key=True)
+    db.Column('movie_id', db.Integer, db.ForeignKey('movie.id'), primary_key=True),
+    updated_at_column(),
+    db.Index('ix_actor_movie_movie_id', 'movie_id'),
+    db.Index('ix_actor_movie_updated_at', 'updated_at', 'actor_id', 'movie_id')
 )
 
+ACTOR_FIELDS = ('id', 'name', 'age', 'gender', 'movie_count', 'movie_ids')
+MOVIE_FIELDS = ('id', 'title', 'release_date', 'actor_count', 'actor_ids')
+
 class Actor(db.Model):
     __tablename__ = 'actor'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(), nullable=False)
-    age = db.Column(db.Integer, nullable=False)
-    gender = db.Column(db.String(), nullable=False)
+    age = db.Column(db.Integer, nullable=False, index=True)
+    gender = db.Column(db.String(), nullable=False, index=True)
+    movie_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = updated_at_column()
+
+    __table_args__ = (
+        db.Index('ix_actor_movie_count', 'movie_count', 'id'),
+        db.Index('ix_actor_updated_at', 'updated_at', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
-    movies = db.relationship('Movie', secondary=actor_movie, lazy='subquery',
+    movies = db.relationship('Movie', secondary=actor_movie, lazy=True,
                              backref=db.backref('actors', lazy=True))
 
-    def get_actor(self):
+    def get_actor(self, movie_ids=None):
+        if movie_ids is None:
+            movie_ids = movie_ids_by_actor([self.id])[self.id]
         return {
             "id": self.id,
             "name": self.name,
             "age": self.age,
             "gender": self.gender,
-            "movie_ids": [movie.id for movie in self.movies]
+            "movie_count": self.movie_count,
+            "movie_ids": movie_ids
         }
 
 class Movie(db.Model):
@@ -45,12 +122,93 @@ class Movie(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(), nullable=False)
-    release_date = db.Column(db.DateTime, nullable=False)
+    release_date = db.Column(db.DateTime, nullable=False, index=True)
+    actor_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = updated_at_column()
 
-    def get_movie(self):
+    __table_args__ = (
+        db.Index('ix_movie_title', 'title', postgresql_ops={'title': 'text_pattern_ops'}),
+        db.Index('ix_movie_actor_count', 'actor_count', 'id'),
+        db.Index('ix_movie_updated_at', 'updated_at', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+    def get_movie(self, actor_ids=None):
+        if actor_ids is None:
+            actor_ids = actor_ids_by_movie([self.id])[self.id]
         return {
             "id": self.id,
             "title": self.title,
             "release_date": self.release_date,
-            "actor_ids": [actor.id for actor in self.actors]
-        }
\ No newline at end of file
+            "actor_count": self.actor_count,
+            "actor_ids": actor_ids
+        }
+
+
+class CatalogStats(db.Model):
+    """Single row of catalog totals, kept up to date by the write helpers in bulk.py."""
+    __tablename__ = 'catalog_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    actors = db.Column(db.Integer, nullable=False, default=0)
+    movies = db.Column(db.Integer, nullable=False, default=0)
+    links = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(db.Model):
+    """A write request seen with an ``Idempotency-Key``; see idempotency.py.
+
+    ``status_code`` is null while the first request is still running;
+    ``headers`` holds the replayed response headers as JSON.
+    """
+    __tablename__ = 'idempotency_key'
+
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    mimetype = db.Column(db.String())
+    body = db.Column(db.LargeBinary)
+    headers = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Tombstone(db.Model):
+    """A deleted actor, movie or link, reported by ``GET /changes``.
+
+    ``kind`` is ``actor``, ``movie`` or ``link``, or ``purge`` for the
+    marker recording the cutoff of the last purge in ``deleted_at``.
+    """
+    __tablename__ = 'tombstone'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(), nullable=False)
+    actor_id = db.Column(db.Integer)
+    movie_id = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_tombstone_deleted_at', 'deleted_at', 'id'),
+        db.Index('ix_tombstone_kind_deleted_at', 'kind', 'deleted_at'),
+    )
+
+
+def _linked_ids(key_column, value_column, keys):
+    linked = {key: [] for key in keys}
+    if not linked:
+        return linked
+    rows = db.session.query(key_column, value_column) \
+        .filter(key_column.in_(list(linked))) \
+        .order_by(key_column, value_column)
+    for key, value in rows:
+        linked[key].append(value)
+    return linked
+
+
+def movie_ids_by_actor(actor_ids):
+    return _linked_ids(actor_movie.c.actor_id, actor_movie.c.movie_id, actor_ids)
+
+
+def actor_ids_by_movie(movie_ids):
+    return _linked_ids(actor_movie.c.movie_id, actor_movie.c.actor_id, movie_ids)
+
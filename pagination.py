@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key='id'):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        abort(400)
+    if not isinstance(values, dict) or not isinstance(values.get(key), int) or values[key] < 0:
+        abort(400)
+    return values
+
+
+def get_limit(args=None, config=None):
+    config = current_app.config if config is None else config
+    default = config.get('PAGE_SIZE', 100)
+    maximum = config.get('MAX_PAGE_SIZE', 1000)
+    limit = get_int_arg('limit', args)
+    if limit is None:
+        return default
+    if limit < 1:
+        abort(400)
+    return min(limit, maximum)
+
+
+def get_int_arg(name, args=None):
+    value = (request.args if args is None else args).get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def get_date_arg(name, args=None):
+    value = (request.args if args is None else args).get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+
+def get_fields(allowed, args=None):
+    value = (request.args if args is None else args).get('fields')
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields or any(field not in allowed for field in fields):
+        abort(400)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def get_sort(columns, args=None):
+    """Return the column named by ``sort`` (``-`` prefix for descending), if any."""
+    value = (request.args if args is None else args).get('sort')
+    if not value:
+        return None, False
+    descending = value.startswith('-')
+    column = columns.get(value[1:] if descending else value)
+    if column is None:
+        abort(400)
+    return column, descending
+
+
+def page_bounds(args=None, config=None):
+    """Return the page size and the decoded cursor the page starts after, if any."""
+    cursor = (request.args if args is None else args).get('cursor')
+    return get_limit(args, config), decode_cursor(cursor) if cursor else None
+
+
+def slice_page(items, args=None, config=None):
+    """Page through the in-memory list ``items`` with an offset cursor."""
+    cursor = (request.args if args is None else args).get('cursor')
+    offset = decode_cursor(cursor, 'offset')['offset'] if cursor else 0
+    end = offset + get_limit(args, config)
+    return items[offset:end], encode_cursor({'offset': end}) if end < len(items) else None
+
+
+def keyset(id_column, cursor, sort_column=None, descending=False):
+    """Return the filter and ordering for the page after ``cursor``.
+
+    Pages are ordered by ``sort_column`` with ``id_column`` breaking ties,
+    so an index on the two columns serves both.
+    """
+    if sort_column is None:
+        order = [id_column]
+        condition = id_column > cursor['id'] if cursor else None
+        return condition, order
+    order = [sort_column.desc(), id_column.desc()] if descending else [sort_column, id_column]
+    condition = None
+    if cursor:
+        key = cursor.get('key')
+        if not isinstance(key, int) or isinstance(key, bool):
+            abort(400)
+        if descending:
+            condition = or_(sort_column < key, and_(sort_column == key, id_column < cursor['id']))
+        else:
+            condition = or_(sort_column > key, and_(sort_column == key, id_column > cursor['id']))
+    return condition, order
+
+
+def next_page(rows, limit, sort_key=None):
+    """Trim the ``limit + 1`` fetched rows to a page and build the next cursor."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        values = {'id': rows[-1].id}
+        if sort_key is not None:
+            values['key'] = getattr(rows[-1], sort_key)
+        return rows, encode_cursor(values)
+    return rows, None
+
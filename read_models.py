@@ -0,0 +1,92 @@
+"""Read-only records for the list endpoints.
+
+The list, batch and export responses only read a few columns, so they
+select those columns and keep each row in a small ``__slots__`` record
+instead of an ORM entity, with no instance state, identity map entry or
+session reference. An actor record takes about a fifth of the memory of
+an ``Actor`` and loads three times faster (``benchmarks/read_models.py``).
+Writes keep using the ORM models.
+"""
+from sqlalchemy import select
+
+from models import db
+from pagination import keyset, next_page, page_bounds
+
+_record_types = {}
+
+
+class Record:
+    __slots__ = ()
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({values})'
+
+
+def record_type(model, columns):
+    """Return the record class holding ``columns`` of ``model``."""
+    key = (model, columns)
+    record = _record_types.get(key)
+    if record is None:
+        # Generated like collections.namedtuple, so that building a record
+        # is one call with positional arguments.
+        name = f'{model.__name__}Record'
+        assignments = ''.join(f'        self.{column} = {column}\n' for column in columns)
+        source = (f'class {name}(Record):\n'
+                  f'    __slots__ = {columns!r}\n'
+                  f'    def __init__(self, {", ".join(columns)}):\n'
+                  f'{assignments}')
+        namespace = {'Record': Record}
+        exec(source, namespace)
+        record = _record_types[key] = namespace[name]
+    return record
+
+
+def record_columns(model, fields=None, extra=()):
+    """Return the names of the columns needed for ``fields``: the id, the
+    requested table columns and ``extra``, in table order."""
+    table = model.__table__
+    wanted = {'id', *extra}
+    wanted.update(table.c.keys() if fields is None else fields)
+    return tuple(column.key for column in table.columns if column.key in wanted)
+
+
+def load_records(model, statement, columns):
+    record = record_type(model, columns)
+    return [record(*row) for row in db.session.execute(statement)]
+
+
+def select_columns(model, columns):
+    return select(*(model.__table__.c[column] for column in columns))
+
+
+def fetch_records(model, ids, fields=None):
+    """Return records for ``ids``, in the order given."""
+    columns = record_columns(model, fields)
+    statement = select_columns(model, columns).where(model.__table__.c.id.in_(ids))
+    records = {record.id: record for record in load_records(model, statement, columns)}
+    return [records[row_id] for row_id in ids if row_id in records]
+
+
+def paginate_records(model, filters, fields=None, sort_column=None, descending=False):
+    """Return a keyset page of ``model`` rows as records, and the next cursor.
+
+    Rows are ordered by ``sort_column`` then id, or by id alone; the
+    cursor is ``None`` on the last page.
+    """
+    limit, cursor = page_bounds()
+    table = model.__table__
+    sort_column = table.c[sort_column.key] if sort_column is not None else None
+    columns = record_columns(model, fields,
+                             (sort_column.key,) if sort_column is not None else ())
+    condition, order = keyset(table.c.id, cursor, sort_column, descending)
+    statement = select_columns(model, columns).where(*filters)
+    if condition is not None:
+        statement = statement.where(condition)
+    rows = load_records(model, statement.order_by(*order).limit(limit + 1), columns)
+    return next_page(rows, limit, sort_column.key if sort_column is not None else None)
+
+
+def export_query(model):
+    """Every row of ``model`` as plain result rows, ordered by id, for streaming."""
+    return db.session.query(*model.__table__.columns).order_by(model.__table__.c.id)
@@ -0,0 +1,211 @@
+"""Route the reads of GET requests to read replicas.
+
+``REPLICA_DATABASE_URLS`` is a comma separated list of replica URLs;
+without it every query goes to the primary. A GET or HEAD request picks
+a healthy replica, round robin, and the session sends its reads there
+(see ``models.RoutingSession``). Everything else stays on the primary:
+other methods, flushes and write statements, the rest of a request once
+it has written, and any request that has to read its own writes:
+
+- a successful write sets the ``read_primary_until`` cookie, which pins
+  the client's reads to the primary for ``READ_YOUR_WRITES_SECONDS``
+- a request with ``X-Read-Primary: 1`` is always served by the primary
+
+Replicas are checked every ``REPLICA_CHECK_INTERVAL`` seconds, in the
+background, and a replica that fails the check, reports more than
+``REPLICA_MAX_LAG`` seconds of replication lag or loses its connection
+during a request is skipped until a check passes again.
+
+Cached responses filled from a replica are kept for at most
+``REPLICA_MAX_LAG`` seconds, and pinned requests skip the cache lookup,
+so the response cache never serves a writer data older than its write.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+
+from flask import current_app, g, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+
+from db_pool import engine_options
+from metrics import Counter, Gauge
+from models import db
+
+logger = logging.getLogger('casting.replicas')
+
+PIN_COOKIE = 'read_primary_until'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Zero when the replica has replayed everything it received, so that an
+# idle primary does not read as lag.
+POSTGRES_LAG = ('SELECT CASE WHEN NOT pg_is_in_recovery() '
+                'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+_routers = weakref.WeakSet()
+
+ROUTED_REQUESTS = Counter(
+    'db_routed_requests_total',
+    'Requests by the database serving their reads and the reason it was chosen.',
+    ['target', 'reason'])
+REPLICA_HEALTHY = Gauge(
+    'db_replica_healthy', 'Whether the replica is receiving reads.',
+    lambda: [({'replica': replica.name}, int(replica.healthy))
+             for router in list(_routers) for replica in router.replicas],
+    ['replica'])
+REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds', 'Replication lag measured by the last health check.',
+    lambda: [({'replica': replica.name}, replica.lag)
+             for router in list(_routers) for replica in router.replicas
+             if replica.lag is not None],
+    ['replica'])
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _handle_error(self, context):
+        if context.is_disconnect:
+            if self.healthy:
+                logger.warning('replica %s failed, reading from the primary: %s',
+                               self.name, context.original_exception)
+            self.healthy = False
+
+    def replication_lag(self, conn):
+        if conn.dialect.name == 'postgresql':
+            return float(conn.exec_driver_sql(POSTGRES_LAG).scalar() or 0)
+        conn.exec_driver_sql('SELECT 1')
+        return 0.0
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as conn:
+                self.lag = self.replication_lag(conn)
+        except exc.SQLAlchemyError as error:
+            if self.healthy:
+                logger.warning('replica %s failed its health check: %s', self.name, error)
+            self.healthy = False
+            return
+        self.healthy = self.lag <= max_lag
+
+
+class ReplicaRouter:
+    """Picks the replica serving a read-only request."""
+
+    def __init__(self, engines, max_lag=5.0, check_interval=10.0):
+        self.replicas = [Replica(name, engine) for name, engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = itertools.count()
+        self._checked_at = time.monotonic()
+        self._checking = False
+        self._lock = threading.Lock()
+        _routers.add(self)
+
+    def check(self):
+        """Check every replica now."""
+        for replica in self.replicas:
+            replica.check(self.max_lag)
+        self._checked_at = time.monotonic()
+
+    def _run_check(self):
+        try:
+            self.check()
+        finally:
+            self._checking = False
+
+    def _check_if_due(self):
+        if time.monotonic() - self._checked_at < self.check_interval or self._checking:
+            return
+        with self._lock:
+            if self._checking:
+                return
+            self._checking = True
+        threading.Thread(target=self._run_check, name='replica-check', daemon=True).start()
+
+    def choose(self):
+        """Return a healthy replica, or None to read from the primary."""
+        self._check_if_due()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+
+def make_router(app):
+    urls = [url.strip() for url in (app.config['REPLICA_DATABASE_URLS'] or '').split(',')
+            if url.strip()]
+    if not urls:
+        return None
+    engines = []
+    for number, url in enumerate(urls, 1):
+        if url.startswith('postgres://'):
+            url = url.replace('postgres://', 'postgresql://', 1)
+        name = f'replica{number}'
+        engines.append((name, db.create_engine(make_url(url), engine_options(url, name=name))))
+    return ReplicaRouter(engines, app.config['REPLICA_MAX_LAG'],
+                         app.config['REPLICA_CHECK_INTERVAL'])
+
+
+def _pinned():
+    if request.headers.get('X-Read-Primary', '').lower() in ('1', 'true', 'yes'):
+        return True
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _route_request():
+    g.db_replica = None
+    g.db_pinned = False
+    router = current_app.extensions.get('replicas')
+    if router is None:
+        return
+    if request.method not in READ_METHODS:
+        ROUTED_REQUESTS.inc(target='primary', reason='write')
+    elif _pinned():
+        g.db_pinned = True
+        ROUTED_REQUESTS.inc(target='primary', reason='pinned')
+    else:
+        replica = router.choose()
+        if replica is None:
+            ROUTED_REQUESTS.inc(target='primary', reason='no_healthy_replica')
+        else:
+            g.db_replica = replica.engine
+            ROUTED_REQUESTS.inc(target=replica.name, reason='read')
+
+
+def use_primary():
+    """Serve the rest of the request's reads from the primary."""
+    g.db_replica = None
+
+
+def _pin_writer(response):
+    if (current_app.extensions.get('replicas') is not None
+            and request.method not in READ_METHODS and response.status_code < 400):
+        seconds = current_app.config['READ_YOUR_WRITES_SECONDS']
+        response.set_cookie(PIN_COOKIE, str(int(time.time()) + seconds),
+                            max_age=seconds, httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('REPLICA_DATABASE_URLS', os.getenv('REPLICA_DATABASE_URLS'))
+    app.config.setdefault('REPLICA_MAX_LAG', float(os.getenv('REPLICA_MAX_LAG', '5')))
+    app.config.setdefault('REPLICA_CHECK_INTERVAL',
+                          float(os.getenv('REPLICA_CHECK_INTERVAL', '10')))
+    app.config.setdefault('READ_YOUR_WRITES_SECONDS',
+                          int(os.getenv('READ_YOUR_WRITES_SECONDS', '10')))
+    app.extensions['replicas'] = make_router(app)
+    app.before_request(_route_request)
+    app.after_request(_pin_writer)
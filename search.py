@@ -0,0 +1,217 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import abort, request
+from sqlalchemy import DDL, event, func, literal_column, or_
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from models import db, Actor, Movie
+from pagination import decode_cursor, encode_cursor, get_limit
+
+SEARCH_COLUMNS = {Actor: Actor.name, Movie: Movie.title}
+
+# Created by migration 3c7d2e91b4a6 and, in DB_SCHEMA_MODE=create, by the
+# DDL below. PostgreSQL only.
+SEARCH_INDEXES = {
+    'ix_actor_name_fts': "CREATE INDEX IF NOT EXISTS ix_actor_name_fts ON actor "
+                         "USING gin (to_tsvector('simple', name))",
+    'ix_actor_name_trgm': "CREATE INDEX IF NOT EXISTS ix_actor_name_trgm ON actor "
+                          "USING gin (name gin_trgm_ops)",
+    'ix_movie_title_fts': "CREATE INDEX IF NOT EXISTS ix_movie_title_fts ON movie "
+                          "USING gin (to_tsvector('simple', title))",
+    'ix_movie_title_trgm': "CREATE INDEX IF NOT EXISTS ix_movie_title_trgm ON movie "
+                           "USING gin (title gin_trgm_ops)",
+}
+
+event.listen(Actor.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for _name, _statement in SEARCH_INDEXES.items():
+    _table = Actor.__table__ if _name.startswith('ix_actor') else Movie.__table__
+    event.listen(_table, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+FUZZY_MIN_LENGTH = 3
+SIMILARITY_THRESHOLD = 0.3
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep alembic autogenerate from dropping the search indexes."""
+    return not (type_ == 'index' and name in SEARCH_INDEXES)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class InvertedIndex:
+    """In-memory word index of one text column, used where PostgreSQL is not.
+
+    Every query term must match a word, by prefix or, for terms of at
+    least ``FUZZY_MIN_LENGTH`` characters without a prefix match, by
+    trigram similarity. Documents are ranked by how well their words
+    match: exact over prefix over fuzzy.
+    """
+
+    def __init__(self, rows=()):
+        self.postings = defaultdict(set)
+        self.trigram_words = defaultdict(set)
+        for row_id, text in rows:
+            for word in tokenize(text):
+                self.postings[word].add(row_id)
+        for word in self.postings:
+            for trigram in trigrams(word):
+                self.trigram_words[trigram].add(word)
+        self.vocabulary = sorted(self.postings)
+
+    def _prefix_words(self, term):
+        i = bisect_left(self.vocabulary, term)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(term):
+            yield self.vocabulary[i]
+            i += 1
+
+    def _fuzzy_words(self, term):
+        candidates = set()
+        for trigram in trigrams(term):
+            candidates |= self.trigram_words.get(trigram, set())
+        for word in candidates:
+            score = similarity(term, word)
+            if score >= SIMILARITY_THRESHOLD:
+                yield word, score
+
+    def _term_scores(self, term):
+        scores = {}
+        for word in self._prefix_words(term):
+            weight = 1.0 if word == term else 0.5 + 0.5 * len(term) / len(word)
+            for row_id in self.postings[word]:
+                scores[row_id] = max(scores.get(row_id, 0.0), weight)
+        if not scores and len(term) >= FUZZY_MIN_LENGTH:
+            for word, score in self._fuzzy_words(term):
+                for row_id in self.postings[word]:
+                    scores[row_id] = max(scores.get(row_id, 0.0), 0.5 * score)
+        return scores
+
+    def search(self, query):
+        """Return the ids matching ``query``, best first."""
+        total = None
+        for term in tokenize(query):
+            scores = self._term_scores(term)
+            if total is None:
+                total = scores
+            else:
+                total = {row_id: total[row_id] + score
+                         for row_id, score in scores.items() if row_id in total}
+            if not total:
+                return []
+        return sorted(total or {}, key=lambda row_id: (-total[row_id], row_id))
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+_fallback = False
+
+
+def text_changed(model):
+    """Drop the index of ``model`` now and again when this transaction commits.
+
+    Called by the writes that insert or delete rows of ``model`` or change
+    its text column. Does nothing where PostgreSQL searches.
+    """
+    if _fallback:
+        table = model.__tablename__
+        _indexes.pop(table, None)
+        db.session.info.setdefault('search_changes', set()).add(table)
+
+
+def _invalidate_on_commit(session):
+    # An index rebuilt between the write and the commit missed the write.
+    for table in session.info.pop('search_changes', ()):
+        _indexes.pop(table, None)
+
+
+def _forget_changes(session, previous_transaction):
+    session.info.pop('search_changes', None)
+
+
+def clear():
+    _indexes.clear()
+
+
+def _index_for(model):
+    table = model.__tablename__
+    index = _indexes.get(table)
+    if index is None:
+        with _lock:
+            index = _indexes.get(table)
+            if index is None:
+                column = SEARCH_COLUMNS[model]
+                index = InvertedIndex(db.session.query(model.id, column).all())
+                _indexes[table] = index
+    return index
+
+
+def _postgres_search(model, query, offset, limit):
+    column = SEARCH_COLUMNS[model]
+    terms = tokenize(query)
+    vector = func.to_tsvector(literal_column("'simple'::regconfig"), column)
+    tsquery = func.to_tsquery(literal_column("'simple'::regconfig"),
+                              ' & '.join(f'{term}:*' for term in terms))
+    matches = vector.op('@@')(tsquery)
+    if len(query) >= FUZZY_MIN_LENGTH:
+        matches = or_(matches, column.op('%')(query))
+    return model.query.filter(matches) \
+        .order_by(func.ts_rank(vector, tsquery).desc(),
+                  func.similarity(column, query).desc(),
+                  model.id) \
+        .offset(offset).limit(limit).all()
+
+
+def _python_search(model, query, offset, limit):
+    ids = _index_for(model).search(query)[offset:offset + limit]
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+
+def search(model, query, offset=0, limit=20):
+    """Rank the rows of ``model`` whose text column matches ``query``."""
+    if db.engine.dialect.name == 'postgresql':
+        return _postgres_search(model, query, offset, limit)
+    return _python_search(model, query, offset, limit)
+
+
+def search_page(model):
+    """Run the search in ``request.args`` and return a page and the next cursor."""
+    query = request.args.get('q', '').strip()
+    if not tokenize(query):
+        abort(400)
+    cursor = request.args.get('cursor')
+    offset = decode_cursor(cursor, 'offset')['offset'] if cursor else 0
+    limit = get_limit()
+    rows = search(model, query, offset, limit + 1)
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor({'offset': offset + limit})
+    return rows, None
+
+
+def init_app(app):
+    global _fallback
+    backend = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if backend != 'postgresql' and not _fallback:
+        event.listen(Session, 'after_commit', _invalidate_on_commit)
+        event.listen(Session, 'after_soft_rollback', _forget_changes)
+        _fallback = True
@@ -0,0 +1,232 @@
+"""JSON encoding for the entity responses.
+
+``JSON_DATE_FORMAT=http`` (the default) keeps Flask's output: RFC 822
+dates and ``JSON_AS_ASCII`` escaping. ``JSON_DATE_FORMAT=iso`` switches
+every response to canonical JSON: sorted keys, ISO 8601 dates and UTF-8
+text. In that mode orjson, when installed, does the generic encoding
+(``JSON_ENCODER=auto``; ``stdlib`` or ``orjson`` to force one); both
+encoders produce the same bytes.
+
+Actors and movies are written by encoders compiled once per model and
+field list, straight from the row attributes without building a dict
+per row, so ORM entities and read_models records encode alike. Pretty
+printing (``JSONIFY_PRETTYPRINT_REGULAR`` or debug) goes through
+``jsonify`` instead.
+"""
+import json
+from datetime import date, datetime, timezone
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from flask import current_app, jsonify
+from sqlalchemy import DateTime, Integer
+
+from instrumentation import phase
+from models import Actor, Movie, ACTOR_FIELDS, MOVIE_FIELDS, movie_ids_by_actor, actor_ids_by_movie
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENTITIES = {
+    Actor: (ACTOR_FIELDS, 'movie_ids', movie_ids_by_actor),
+    Movie: (MOVIE_FIELDS, 'actor_ids', actor_ids_by_movie),
+}
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _links(model, rows, fields):
+    all_fields, link_field, linked_ids = ENTITIES[model]
+    ids = [row.id for row in rows]
+    if fields is None or link_field in fields:
+        return linked_ids(ids)
+    return dict.fromkeys(ids, ())
+
+
+def entity_dicts(model, rows, fields=None):
+    """Return the response dicts of ``rows``: entities, records or result rows."""
+    all_fields, link_field, _ = ENTITIES[model]
+    links = _links(model, rows, fields)
+    return [{field: list(links[row.id]) if field == link_field else getattr(row, field)
+             for field in fields or all_fields}
+            for row in rows]
+
+
+def http_date_text(value):
+    # What flask.json.JSONEncoder writes (werkzeug's http_date of the UTC
+    # time tuple), formatted directly.
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        time_of_day = f'{value.hour:02d}:{value.minute:02d}:{value.second:02d}'
+    else:
+        time_of_day = '00:00:00'
+    return (f'"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} '
+            f'{value.year:04d} {time_of_day} GMT"')
+
+
+def iso_date_text(value):
+    return '"' + value.isoformat() + '"'
+
+
+class Raw:
+    """JSON text to be written into a response as is."""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class JSONProvider:
+    """Encodes with the standard library and ``app.json_encoder``."""
+    name = 'stdlib'
+
+    def __init__(self, app):
+        self.json_encoder = app.json_encoder
+        self.sort_keys = app.config['JSON_SORT_KEYS']
+        self.ensure_ascii = app.config['JSON_AS_ASCII']
+        self.encode_string = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+        iso = app.config['JSON_DATE_FORMAT'] == 'iso'
+        self.encode_date = iso_date_text if iso else http_date_text
+        self._serializers = {}
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=self.json_encoder, sort_keys=self.sort_keys,
+                          ensure_ascii=self.ensure_ascii, separators=(',', ':'))
+
+    def compose(self, payload):
+        """Encode the dict ``payload``, whose values may be ``Raw`` JSON text."""
+        keys = sorted(payload) if self.sort_keys else payload
+        return '{' + ','.join(
+            self.encode_string(key) + ':' + (value.text if isinstance(value, Raw)
+                                             else self.dumps(value))
+            for key, value in ((key, payload[key]) for key in keys)) + '}'
+
+    def serializer(self, model, fields=None):
+        """Return the compiled ``encode(row, linked_ids)`` for ``model`` and ``fields``."""
+        key = (model, tuple(fields) if fields is not None else None)
+        serializer = self._serializers.get(key)
+        if serializer is None:
+            serializer = self._serializers[key] = self._compile(model, fields)
+        return serializer
+
+    def _compile(self, model, fields):
+        # Generated source, as in read_models.record_type: one format
+        # string and one tuple of attribute reads per row.
+        all_fields, link_field = ENTITIES[model][:2]
+        fields = list(fields if fields is not None else all_fields)
+        if self.sort_keys:
+            fields.sort()
+        parts, values = [], []
+        for field in fields:
+            name = self.encode_string(field).replace('%', '%%')
+            if field == link_field:
+                parts.append(f'{name}:[%s]')
+                values.append("','.join(map(str, links))")
+                continue
+            column = model.__table__.c[field]
+            if isinstance(column.type, Integer) and not column.nullable:
+                # SQLite does not enforce column types, so anything but an
+                # int goes through the generic encoder.
+                parts.append(f'{name}:%s')
+                values.append(f'(str(row.{field}) if row.{field}.__class__ is int '
+                              f'else _dumps(row.{field}))')
+                continue
+            encode = '_date' if isinstance(column.type, DateTime) else '_string'
+            parts.append(f'{name}:%s')
+            if column.nullable:
+                values.append(f"('null' if row.{field} is None else {encode}(row.{field}))")
+            else:
+                values.append(f'{encode}(row.{field})')
+        source = (f"def encode(row, links, _string=_string, _date=_date, _dumps=_dumps):\n"
+                  f"    return {'{' + ','.join(parts) + '}'!r} % ({', '.join(values)},)\n")
+        namespace = {'_string': self.encode_string, '_date': self.encode_date,
+                     '_dumps': self.dumps}
+        exec(source, namespace)
+        return namespace['encode']
+
+    def encode_entities(self, model, rows, fields=None):
+        """Encode ``rows`` of ``model`` as a JSON array, loading their links in one query."""
+        links = _links(model, rows, fields)
+        encode = self.serializer(model, fields)
+        return '[' + ','.join([encode(row, links[row.id]) for row in rows]) + ']'
+
+
+class OrjsonProvider(JSONProvider):
+    """Encodes with orjson; only used for canonical (ISO, UTF-8) output."""
+    name = 'orjson'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.options = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        self.default = app.json_encoder().default
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode('utf-8')
+
+
+def make_provider(app):
+    choice = app.config['JSON_ENCODER']
+    canonical = app.config['JSON_DATE_FORMAT'] == 'iso'
+    if choice == 'orjson' and (orjson is None or not canonical):
+        raise ValueError('JSON_ENCODER=orjson needs orjson installed and JSON_DATE_FORMAT=iso')
+    if choice in ('auto', 'orjson') and orjson is not None and canonical:
+        return OrjsonProvider(app)
+    return JSONProvider(app)
+
+
+def init_app(app):
+    app.config.setdefault('JSON_DATE_FORMAT', 'http')
+    app.config.setdefault('JSON_ENCODER', 'auto')
+    if app.config['JSON_DATE_FORMAT'] not in ('http', 'iso'):
+        raise ValueError(f"Unknown JSON_DATE_FORMAT {app.config['JSON_DATE_FORMAT']!r}")
+    if app.config['JSON_DATE_FORMAT'] == 'iso':
+        class ISOJSONEncoder(app.json_encoder):
+            def default(self, o):
+                if isinstance(o, date):
+                    return o.isoformat()
+                return super().default(o)
+
+        app.json_encoder = ISOJSONEncoder
+        app.config['JSON_AS_ASCII'] = False
+    app.extensions['json_provider'] = make_provider(app)
+
+
+def _pretty():
+    return current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+
+
+def _response(provider, payload):
+    with phase('serialize'):
+        body = provider.compose(payload) + '\n'
+    return current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def entities_response(model, key, rows, fields=None, **extra):
+    """Respond with ``{"success": true, key: [rows...], **extra}``."""
+    provider = current_app.extensions['json_provider']
+    if _pretty():
+        return jsonify({"success": True, key: entity_dicts(model, rows, fields), **extra})
+    return _response(provider, {"success": True,
+                                key: Raw(provider.encode_entities(model, rows, fields)),
+                                **extra})
+
+
+def entity_etag(row):
+    """The ETag of an actor or movie: its version, which every write bumps."""
+    return f'v{row.version}'
+
+
+def entity_response(model, key, row):
+    """Respond with ``{"success": true, key: row}``, tagged with the row's version."""
+    provider = current_app.extensions['json_provider']
+    if _pretty():
+        response = jsonify({"success": True, key: entity_dicts(model, [row])[0]})
+    else:
+        response = _response(provider, {"success": True,
+                                        key: Raw(provider.encode_entities(model, [row])[1:-1])})
+    response.set_etag(entity_etag(row))
+    return response
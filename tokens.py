@@ -0,0 +1,102 @@
+"""Mint access tokens that the API accepts without Auth0.
+
+Tokens carry the issuer, audience and permissions Auth0 would issue for
+each role and are signed with a local RSA key. Point the API at the
+same key with ``AUTH_KEY_SOURCE=local AUTH_PRIVATE_KEY_FILE=key.pem``,
+or at the public half with ``AUTH_KEY_SOURCE=file JWKS_FILE=jwks.json``.
+
+    python tokens.py keygen --key key.pem --jwks jwks.json
+    python tokens.py mint --key key.pem --role casting_assistant --count 100000 > tokens.txt
+"""
+import argparse
+import json
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+
+from jose import jwt
+
+from auth import ALGORITHMS, API_AUDIENCE, JWT_ISSUER
+from jwks import LocalKeyPair
+
+ROLES = {
+    'casting_assistant': ['get:actors', 'get:movies'],
+    'casting_director': ['delete:actors', 'get:actors', 'get:movies', 'patch:actors',
+                         'patch:movies', 'post:actors'],
+    'executive_producer': ['delete:actors', 'delete:movies', 'get:actors', 'get:movies',
+                           'patch:actors', 'patch:movies', 'post:actors', 'post:movies'],
+}
+
+
+def mint_token(keys, permissions, subject='local|user', ttl=3600, now=None, **claims):
+    """Sign a token for ``subject`` with ``keys`` (a ``LocalKeyPair``)."""
+    now = int(time.time() if now is None else now)
+    claims.update({
+        'iss': JWT_ISSUER,
+        'aud': API_AUDIENCE,
+        'sub': subject,
+        'iat': now,
+        'exp': now + ttl,
+        'permissions': list(permissions),
+    })
+    return jwt.encode(claims, keys.signing_key, algorithm=ALGORITHMS[0],
+                      headers={'kid': keys.kid})
+
+
+def _mint_range(private_pem, kid, permissions, ttl, now, bounds):
+    keys = LocalKeyPair(private_pem, kid=kid)
+    return [mint_token(keys, permissions, f'local|user-{i}', ttl, now)
+            for i in range(*bounds)]
+
+
+def mint_tokens(keys, permissions, count, ttl=3600, processes=1, chunk_size=10000):
+    """Yield ``count`` tokens for distinct subjects, signed on ``processes`` cores."""
+    now = int(time.time())
+    chunks = [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+    mint = partial(_mint_range, keys.private_pem, keys.kid, permissions, ttl, now)
+    if processes == 1:
+        for bounds in chunks:
+            yield from mint(bounds)
+        return
+    with Pool(processes) as pool:
+        for tokens in pool.imap(mint, chunks):
+            yield from tokens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    keygen = commands.add_parser('keygen', help='write a new private key and its JWKS')
+    keygen.add_argument('--key', required=True, help='PEM file for the private key')
+    keygen.add_argument('--jwks', help='JSON file for the public key set')
+    keygen.add_argument('--kid', default='local')
+
+    mint = commands.add_parser('mint', help='print tokens, one per line')
+    mint.add_argument('--key', required=True, help='PEM private key from keygen')
+    mint.add_argument('--kid', default='local')
+    mint.add_argument('--role', choices=sorted(ROLES), default='casting_assistant')
+    mint.add_argument('--permissions', help='comma separated, overrides --role')
+    mint.add_argument('--count', type=int, default=1)
+    mint.add_argument('--ttl', type=int, default=3600)
+    mint.add_argument('--processes', type=int, default=1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'keygen':
+        keys = LocalKeyPair(kid=args.kid)
+        with open(args.key, 'wb') as f:
+            f.write(keys.private_pem)
+        if args.jwks:
+            with open(args.jwks, 'w') as f:
+                json.dump(keys.jwks(), f)
+        return
+
+    keys = LocalKeyPair.from_file(args.key, kid=args.kid)
+    permissions = args.permissions.split(',') if args.permissions else ROLES[args.role]
+    for token in mint_tokens(keys, permissions, args.count, args.ttl, args.processes):
+        sys.stdout.write(token + '\n')
+
+
+if __name__ == '__main__':
+    main()